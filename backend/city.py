@@ -13,144 +13,28 @@ city.export_to_file("data/map_save.txt", "data/bus_save.txt")
 """
 
 from __future__ import annotations
-from typing import Union
+from typing import Optional, Union
 
 import copy
-import pandas as pd
-
-from sklearn.cluster import KMeans
-from visual.drawing import *
+import functools
+import heapq
+import itertools
+import os
+import random
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from backend.csr import CSRGraph, PLACE_KIND, INTERSECTION_KIND, BUS_STOP_KIND
+from backend.map_reader import read_bus_file, read_map_file
+from backend.place import _Place, _Intersection, _BusStop
+from backend.snapshot import CitySnapshot, cluster_places, incremental_clusterings, \
+    score_bus_stops, score_centers
+from utils.binary_format import read_arrays, write_arrays
+from utils.spatial_index import GridIndex
 from utils.utility_functions import *
 
 
-class _Place(Drawable):
-    """A vertex in the City graph, used to represent a place in the city.
-
-    Instance Attributes:
-        - pos: The coordinates of the CENTRE of the place
-        - neighbours: The vertices that are adjacent to this vertex and their respective distances
-        - WIDTH: The width of this place in pixels, this place will be drawn as a square with
-                 side length WIDTH
-
-    Representation Invariants:
-        - self not in self.neighbours
-        - all(self in u.neighbours for u in self.neighbours)
-        - 0 <= self.pos[0] <= WIDTH and 0 <= self.pos[1] <= HEIGHT
-    """
-    pos: tuple[float, float]
-    neighbours: dict[_Place, float]
-    WIDTH: int = 20
-
-    def __init__(self, pos: tuple[float, float]) -> None:
-        self.pos = pos
-        self.neighbours = dict()
-
-    def __str__(self) -> str:
-        """
-        Convert this place to a string in the following format: 'place x y' where
-        x and y are the coordinates of this place
-        """
-        x, y = self.pos
-        return "place " + str(x) + " " + str(y)
-
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        rect = pygame.Rect(x - self.WIDTH // 2, y - self.WIDTH // 2, self.WIDTH, self.WIDTH)
-        pygame.draw.rect(screen, PLACE, rect)
-
-    def pos_on_place(self, m_pos: tuple[int, int]) -> bool:
-        """
-        Return whether the given mouse position <m_pos> is on this place on the canvas.
-        """
-        x, y = self.pos  # x and y coords of this place's centre on the canvas
-
-        top_left_corner = (x - self.WIDTH // 2, y - self.WIDTH // 2)
-        bottom_right_corner = (x + self.WIDTH // 2, y + self.WIDTH // 2)
-
-        x1, y1 = top_left_corner
-        x2, y2 = bottom_right_corner
-
-        mx, my = m_pos
-
-        # See if m_pos is within the box bounded by top left and bottom right corners
-        if (x1 < mx < x2) and (y1 < my < y2):
-            return True
-        return False
-
-
-class _Intersection(_Place):
-    """A vertex in the City graph, used to represent a road intersection in the city. Functionally
-     the same as _Place but it is drawn as a grey circle on the canvas.
-    """
-    def __init__(self, pos: tuple[float, float]) -> None:
-        super().__init__(pos)
-
-    def __str__(self) -> str:
-        """
-        Convert this intersection to a string in the following format: 'intersection x y' where
-        x and y are the coordinates of this place
-        """
-        x, y = self.pos
-        return "intersection " + str(x) + " " + str(y)
-
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        pygame.draw.circle(screen, STREET, (x, y), City.STREET_WIDTH)
-
-
-class _BusStop(_Place):
-    """A vertex in the City graph, used to represent a bus stop in the city.
-
-    Instance Attributes:
-        - wait_time: Time the bus takes at the bus stop
-        - neighbours: The bus stop's neighbours
-    """
-    neighbours: dict[_Place, float]
-    WIDTH: int = 20
-
-    def __init__(self, pos: tuple[float, float]) -> None:
-        super().__init__(pos)
-        self.neighbours = dict()
-
-    def __str__(self) -> str:
-        """
-        Convert this place to a string in the following format: 'bus_stop x y' where
-        x and y are the coordinates of this place
-        """
-        x, y = self.pos
-        return "bus_stop " + str(x) + " " + str(y)
-
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        rect = pygame.Rect(x - self.WIDTH // 2, y - self.WIDTH // 2, self.WIDTH, self.WIDTH)
-        pygame.draw.rect(screen, BUS_STOP, rect)
-
-    def pos_on_bus_stop(self, m_pos: tuple[int, int]) -> bool:
-        """Return whether the given mouse position <m_pos> is on this bus stop on the canvas.
-        """
-        x, y = self.pos  # x and y coords of this place's centre on the canvas
-
-        top_left_corner = (x - self.WIDTH // 2, y - self.WIDTH // 2)
-        bottom_right_corner = (x + self.WIDTH // 2, y + self.WIDTH // 2)
-
-        x1, y1 = top_left_corner
-        x2, y2 = bottom_right_corner
-
-        mx, my = m_pos
-
-        # See if m_pos is within the box bounded by top left and bottom right corners
-        if (x1 < mx < x2) and (y1 < my < y2):
-            return True
-        return False
-
-
-class City(Drawable):
+class City:
     """A graph used to represent a city's road network
 
    Instance Attributes:
@@ -164,6 +48,16 @@ class City(Drawable):
         - _bus_stops: a list of 1. dictionary of coordinate to bus stop pairs 2. inertia
                     (basically measures how good a bus stop system is, the less the better)
         - _bus_routes: # TODO
+        - _landmarks: a dictionary mapping each landmark picked by prepare_landmarks to the
+                    shortest distance from that landmark to every place it can reach
+        - _csr: the CSR form of this city returned by to_csr, or None if the city has changed
+                since it was last built
+        - _place_index: a grid of the squares drawn for the places, used for hit-testing
+        - _bus_stop_index: a grid of the squares drawn for the bus stops, used for hit-testing
+        - _street_index: a grid of the bounding boxes of the streets (see _street_box), used
+                         for hit-testing
+        - _bus_stop_splits: a dictionary mapping every bus stop put in the middle of a street
+                            by _bus_stop_projections to that original street
 
     Representation Invariants:
         # TODO
@@ -172,6 +66,12 @@ class City(Drawable):
     _streets: set[tuple[tuple, tuple]]
     _bus_stops: list[dict[tuple: _BusStop], float]
     _bus_routes: list[list[tuple]]
+    _landmarks: dict[tuple, dict[tuple, float]]
+    _csr: Optional[CSRGraph]
+    _place_index: GridIndex
+    _bus_stop_index: GridIndex
+    _street_index: GridIndex
+    _bus_stop_splits: dict[tuple, tuple[tuple, tuple]]
     STREET_WIDTH: int = 10
 
     def __init__(self) -> None:
@@ -179,6 +79,12 @@ class City(Drawable):
         self._streets = set()
         self._bus_stops = [dict(), -1.0]
         self._bus_routes = []
+        self._landmarks = dict()
+        self._csr = None
+        self._place_index = GridIndex()
+        self._bus_stop_index = GridIndex()
+        self._street_index = GridIndex()
+        self._bus_stop_splits = dict()
 
     # ========================================================
     # File I/O
@@ -264,34 +170,156 @@ class City(Drawable):
         """
         with open(output_map, 'w') as f:
             # First, write all the place information
-            for pos in self._places:
-                place = self._places[pos]
-
-                f.write(str(place) + '\n')
+            f.writelines(str(self._places[pos]) + '\n' for pos in self._places)
 
             # Next, write all the street information
-            for street in self._streets:
-                p1, p2 = street
-                x1, y1 = p1
-                x2, y2 = p2
-                f.write(str(x1) + " " + str(y1) + " " + str(x2) + " " + str(y2) + '\n')
+            f.writelines(f"{x1} {y1} {x2} {y2}\n" for (x1, y1), (x2, y2) in self._streets)
 
         with open(output_bus, 'w') as f:
             # First, write down the inertia
             f.write("inertia " + str(self._bus_stops[1]) + '\n')
 
             # Second, write all the bus stop information
-            for pos in self._bus_stops[0]:
-                place = self._bus_stops[0][pos]
-                f.write(str(place) + '\n')
+            f.writelines(str(self._bus_stops[0][pos]) + '\n' for pos in self._bus_stops[0])
 
             # Next, write all the bus routes information
-            for route in self._bus_routes:
-                route_string = ""
-                for place in route:
-                    x1, y1 = place
-                    route_string += str(x1) + " " + str(y1) + " "
-                f.write(route_string + '\n')
+            f.writelines(''.join(f"{x} {y} " for x, y in route) + '\n'
+                         for route in self._bus_routes)
+
+    @staticmethod
+    def build_from_arrays(place_coords: np.ndarray, place_kinds: np.ndarray,
+                          bus_stop_coords: np.ndarray, edges: np.ndarray,
+                          routes: list[list[tuple]] = None, inertia: float = -1.0) -> City:
+        """
+        Build a city in one step from arrays, rather than one add_place or add_street at a time.
+
+        - place_coords has shape (n, 2), and place_kinds says whether each place is a place
+          (PLACE_KIND) or an intersection (INTERSECTION_KIND)
+        - bus_stop_coords has shape (b, 2)
+        - edges has shape (m, 2), and every row is a street given as the indices of its two
+          endpoints, where indices 0 to n - 1 are the places and n to n + b - 1 are the bus stops
+
+        If inertia is -1.0 and there are both places and bus stops, the inertia is calculated
+        (as in build_from_file).
+
+        Preconditions:
+          - no two places and no two bus stops have the same coordinates
+          - all(0 <= i < n + b for edge in edges for i in edge)
+          - all(edge[0] != edge[1] for edge in edges)
+        """
+        city = City()
+
+        place_positions = [tuple(pos) for pos in np.asarray(place_coords).tolist()]
+        bus_stop_positions = [tuple(pos) for pos in np.asarray(bus_stop_coords).tolist()]
+
+        for pos, kind in zip(place_positions, np.asarray(place_kinds).tolist()):
+            city.add_place(pos, 'intersection' if kind == INTERSECTION_KIND else 'place')
+        for pos in bus_stop_positions:
+            city.add_bus_stop(pos)
+
+        # Look every vertex up once, then measure every street at the same time
+        vertices = [city._places[pos] for pos in place_positions] + \
+            [city._bus_stops[0][pos] for pos in bus_stop_positions]
+        coords = np.vstack([np.asarray(place_coords, dtype=np.float64).reshape(-1, 2),
+                            np.asarray(bus_stop_coords, dtype=np.float64).reshape(-1, 2)])
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        offsets = coords[edges[:, 0]] - coords[edges[:, 1]]
+        lengths = np.sqrt(offsets[:, 0] * offsets[:, 0] + offsets[:, 1] * offsets[:, 1])
+
+        for (i, j), length in zip(edges.tolist(), lengths.tolist()):
+            city._connect(vertices[i], vertices[j], length)
+
+        for route in routes or []:
+            city.add_bus_route(route)
+
+        if inertia != -1.0:
+            city.change_inertia(inertia)
+        elif len(place_positions) != 0 and len(bus_stop_positions) != 0:
+            city.change_inertia(city.calculate_inertia(place_positions, bus_stop_positions))
+
+        return city
+
+    @staticmethod
+    def build_from_stream(map_file: str, bus_file: str, chunk_size: int = 65536) -> City:
+        """
+        Build a city from the given .txt files, like build_from_file, but by reading the map
+        file chunk_size lines at a time into arrays and building the city from them in one
+        step (see backend/map_reader.py). Unlike build_from_file, a street may come before
+        the places it connects.
+
+        Raise a MapFormatError (a ValueError) giving the file and line number if a line cannot
+        be read, or if a street does not connect two different places or bus stops.
+
+        Preconditions:
+          - The input file is in the same format described in export_to_file
+          - chunk_size > 0
+        """
+        bus_stop_coords, routes, inertia = read_bus_file(bus_file)
+        place_coords, place_kinds, edges = read_map_file(map_file, bus_stop_coords, chunk_size)
+
+        return City.build_from_arrays(place_coords, place_kinds, bus_stop_coords, edges, routes,
+                                      inertia)
+
+    @staticmethod
+    def build_from_binary(city_file: str) -> City:
+        """
+        Build a city from a binary file written by export_to_binary. The arrays in the file are
+        memory-mapped rather than parsed (see utils/binary_format.py).
+
+        Preconditions:
+          - city_file was written by export_to_binary
+        """
+        arrays, metadata = read_arrays(city_file)
+
+        offsets = arrays['route_offsets'].tolist()
+        route_coords = [tuple(pos) for pos in arrays['route_coords'].tolist()]
+        routes = [route_coords[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+        return City.build_from_arrays(arrays['place_coords'], arrays['place_kinds'],
+                                      arrays['bus_stop_coords'], arrays['edges'], routes,
+                                      metadata['inertia'])
+
+    def export_to_binary(self, city_file: str) -> None:
+        """
+        Export the city to a binary file made of the following arrays (see
+        utils/binary_format.py for the layout):
+
+        - place_coords: the coordinates of every place, as an (n, 2) int64 array
+        - place_kinds: PLACE_KIND or INTERSECTION_KIND for every place, as int8
+        - bus_stop_coords: the coordinates of every bus stop, as a (b, 2) int64 array
+        - edges: every street as the indices of its endpoints, places first and then bus stops,
+                 as an (m, 2) int64 array
+        - route_coords: the coordinates of every bus route one after another, as an int64 array
+        - route_offsets: where each bus route starts and ends in route_coords
+
+        and the inertia, which is stored in the header.
+
+        Preconditions:
+            - city_file is a valid file
+            - all coordinates in the city are integers
+        """
+        place_positions = list(self._places)
+        bus_stop_positions = list(self._bus_stops[0])
+
+        ids = {pos: len(place_positions) + i for i, pos in enumerate(bus_stop_positions)}
+        ids.update({pos: i for i, pos in enumerate(place_positions)})
+
+        place_kinds = [INTERSECTION_KIND if isinstance(self._places[pos], _Intersection)
+                       else PLACE_KIND for pos in place_positions]
+        route_offsets = [0]
+        for route in self._bus_routes:
+            route_offsets.append(route_offsets[-1] + len(route))
+
+        write_arrays(city_file, {
+            'place_coords': np.array(place_positions, dtype=np.int64).reshape(-1, 2),
+            'place_kinds': np.array(place_kinds, dtype=np.int8),
+            'bus_stop_coords': np.array(bus_stop_positions, dtype=np.int64).reshape(-1, 2),
+            'edges': np.array([(ids[p1], ids[p2]) for p1, p2 in self._streets],
+                              dtype=np.int64).reshape(-1, 2),
+            'route_coords': np.array([pos for route in self._bus_routes for pos in route],
+                                     dtype=np.int64).reshape(-1, 2),
+            'route_offsets': np.array(route_offsets, dtype=np.int64)
+        }, {'inertia': self._bus_stops[1]})
 
     # ========================================================
     # Mutating instance attributes
@@ -310,6 +338,8 @@ class City(Drawable):
             else:
                 p = _Place(pos)
             self._places.update({pos: p})
+            self._place_index.insert(pos, self._place_box(p))
+            self._graph_changed()
 
     def delete_place(self, pos: tuple[float, float]) -> None:
         """
@@ -324,6 +354,8 @@ class City(Drawable):
             for neighbour in neighbours_copy:
                 self.delete_street(p.pos, neighbour.pos)
             self._places.pop(pos)
+            self._place_index.remove(pos)
+            self._graph_changed()
 
     def add_street(self, pos1: tuple, pos2: tuple) -> None:
         """
@@ -345,16 +377,29 @@ class City(Drawable):
             else:
                 p2 = self._bus_stops[0][pos2]
 
-            dist = distance(pos1, pos2)
-            p1.neighbours.update({p2: dist})
-            p2.neighbours.update({p1: dist})
-
-            # Prevent duplicate streets: (a, b) = (b, a)
-            if (pos2, pos1) not in self._streets:
-                self._streets.add((pos1, pos2))
+            self._connect(p1, p2, distance(pos1, pos2))
         else:
             raise ValueError
 
+    def _connect(self, p1: _Place, p2: _Place, dist: float) -> None:
+        """
+        Add a street of length dist between the two given vertices of this city.
+
+        Preconditions:
+          - p1.pos != p2.pos
+          - dist == distance(p1.pos, p2.pos)
+        """
+        pos1, pos2 = p1.pos, p2.pos
+        p1.neighbours.update({p2: dist})
+        p2.neighbours.update({p1: dist})
+
+        # Prevent duplicate streets: (a, b) = (b, a)
+        if (pos2, pos1) not in self._streets:
+            self._streets.add((pos1, pos2))
+            self._street_index.insert((pos1, pos2), self._street_box((pos1, pos2)))
+
+        self._graph_changed()
+
     def delete_street(self, pos1: tuple[float, float], pos2: tuple[float, float]) -> None:
         """
         Remove a street between two places
@@ -375,6 +420,8 @@ class City(Drawable):
             p1.neighbours.pop(p2, None)
             p2.neighbours.pop(p1, None)
             self._streets.remove((pos1, pos2))
+            self._street_index.remove((pos1, pos2))
+            self._graph_changed()
         elif (pos2, pos1) in self._streets:
             if pos1 in self._places:
                 p1 = self._places[pos1]
@@ -388,6 +435,8 @@ class City(Drawable):
             p1.neighbours.pop(p2, None)
             p2.neighbours.pop(p1, None)
             self._streets.remove((pos2, pos1))
+            self._street_index.remove((pos2, pos1))
+            self._graph_changed()
 
     def add_bus_stop(self, pos: tuple[float, float]) -> None:
         """
@@ -399,55 +448,58 @@ class City(Drawable):
         if pos not in self._bus_stops[0]:
             p = _BusStop(pos)
             self._bus_stops[0].update({pos: p})
+            self._bus_stop_index.insert(pos, self._place_box(p))
+            self._graph_changed()
 
     def clear_bus_stops(self) -> None:
         """Clear all bus stops and reconnect the "disconnected" streets
 
                     A----BUS_STOP---B becomes A--------B
+
+        Every street split by _bus_stop_projections is recorded in self._bus_stop_splits, so
+        only those splits are undone, latest first.
         """
         # Reconnect the "disconnected" streets caused by _bus_stop_projected()
-        changed_streets = copy.copy(self._streets)
-        for street in changed_streets:
-            p1 = street[0]
-            p2 = street[1]
-            if (p1 in self._places and p1 in self._bus_stops[0]) or (
-                    p2 in self._places and p2 in self._bus_stops[0]):
-                pass
-            elif p1 in self._bus_stops[0]:
-                streets2 = copy.copy(changed_streets)
-                streets2.remove(street)
-                for street2 in streets2:
-                    p3 = street2[0]
-                    p4 = street2[1]
-                    if p3 == p1:
-                        self.delete_street(p1, p2)
-                        self.delete_street(p3, p4)
-                        self.add_street(p2, p4)
-                        break
-                    elif p4 == p1:
-                        self.delete_street(p1, p2)
-                        self.delete_street(p3, p4)
-                        self.add_street(p2, p3)
-                        break
-            elif p2 in self._bus_stops[0]:
-                streets2 = copy.copy(changed_streets)
-                streets2.remove(street)
-                for street2 in streets2:
-                    p3 = street2[0]
-                    p4 = street2[1]
-                    if p3 == p2:
-                        self.delete_street(p1, p2)
-                        self.delete_street(p3, p4)
-                        self.add_street(p1, p4)
-                        break
-                    elif p4 == p2:
-                        self.delete_street(p1, p2)
-                        self.delete_street(p3, p4)
-                        self.add_street(p1, p3)
-                        break
+        for pos in reversed(list(self._bus_stops[0])):
+            if pos in self._places:
+                # The bus stop is on a place, so no street was split
+                continue
+
+            original_street = self._split_street(pos)
+            for neighbour in list(self._bus_stops[0][pos].neighbours):
+                self.delete_street(pos, neighbour.pos)
+            if original_street is not None:
+                self.add_street(original_street[0], original_street[1])
 
         # Clear all bus stops
         self._bus_stops[0].clear()
+        self._bus_stop_splits.clear()
+        self._bus_stop_index.clear()
+        self._graph_changed()
+
+    def _split_street(self, pos: tuple[float, float]) -> Optional[tuple[tuple, tuple]]:
+        """
+        Return the street that the bus stop at pos was put in the middle of, or None if there is
+        none (or if either of its endpoints has since been deleted).
+
+        Bus stops placed by _bus_stop_projections are looked up in self._bus_stop_splits. A bus
+        stop read from a file is assumed to split the street between its two neighbours, if it
+        has exactly two.
+
+        Preconditions:
+            - pos in self._bus_stops[0]
+        """
+        if pos in self._bus_stop_splits:
+            p1, p2 = self._bus_stop_splits[pos]
+        else:
+            neighbours = [neighbour.pos for neighbour in self._bus_stops[0][pos].neighbours]
+            if len(neighbours) != 2:
+                return None
+            p1, p2 = neighbours
+
+        if p1 in self._places and p2 in self._places:
+            return (p1, p2)
+        return None
 
     def add_bus_route(self, route: list[tuple]) -> None:
         """Add a bus route to the list self._bus_routes
@@ -463,6 +515,14 @@ class City(Drawable):
         """
         self._bus_routes = []
 
+    def _graph_changed(self) -> None:
+        """Discard everything computed from the current graph (the landmark distances and the
+        CSR form), since it is now out of date. Called whenever a place, bus stop or street is
+        added or removed.
+        """
+        self._landmarks = dict()
+        self._csr = None
+
     def change_inertia(self, inertia: float) -> None:
         """Change the inertia of the current bus system
         """
@@ -489,6 +549,58 @@ class City(Drawable):
         else:
             raise ValueError
 
+    def _get_place(self, pos: tuple[float, float]) -> _Place:
+        """
+        Return the vertex at the given position, looking in self._places first and then in the
+        bus stops.
+
+        Preconditions:
+            - pos in self._places or pos in self._bus_stops[0]
+        """
+        if pos in self._places:
+            return self._places[pos]
+        return self._bus_stops[0][pos]
+
+    def to_csr(self) -> CSRGraph:
+        """
+        Return this city in CSR form. The CSR graph is built once and reused until the city
+        changes.
+
+        A position that is both a place and a bus stop becomes a single vertex, using the place
+        (as get_neighbours does).
+        """
+        if self._csr is not None:
+            return self._csr
+
+        vertices = dict(self._bus_stops[0])
+        vertices.update(self._places)
+
+        positions = list(vertices)
+        ids = {pos: i for i, pos in enumerate(positions)}
+        kinds = np.empty(len(positions), dtype=np.int8)
+
+        indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        indices = []
+        weights = []
+
+        for i, pos in enumerate(positions):
+            vertex = vertices[pos]
+            if pos not in self._places:
+                kinds[i] = BUS_STOP_KIND
+            elif isinstance(vertex, _Intersection):
+                kinds[i] = INTERSECTION_KIND
+            else:
+                kinds[i] = PLACE_KIND
+
+            for neighbour, weight in vertex.neighbours.items():
+                indices.append(ids[neighbour.pos])
+                weights.append(weight)
+            indptr[i + 1] = len(indices)
+
+        self._csr = CSRGraph(positions, kinds, indptr, np.asarray(indices, dtype=np.int32),
+                             np.asarray(weights, dtype=np.float64))
+        return self._csr
+
     def get_all_places(self) -> set:
         """Return set of all place coordinates in the city that is not a bus stop
         """
@@ -499,6 +611,26 @@ class City(Drawable):
         """
         return set(pos for pos in self._bus_stops[0])
 
+    def get_streets(self) -> set:
+        """Return set of all streets in the city, as pairs of coordinates
+        """
+        return set(self._streets)
+
+    def get_place_kind(self, pos: tuple[float, float]) -> str:
+        """
+        Return the kind of the vertex at the given position: 'place', 'intersection' or
+        'bus_stop'. A position that is both a place and a bus stop is treated as a place.
+
+        Preconditions:
+            - pos in self._places or pos in self._bus_stops[0]
+        """
+        if pos not in self._places:
+            return 'bus_stop'
+        elif isinstance(self._places[pos], _Intersection):
+            return 'intersection'
+        else:
+            return 'place'
+
     def get_distance(self, pos1: tuple[float, float], pos2: tuple[float, float]) -> float:
         """
         Return the distance between two neighbours
@@ -534,7 +666,8 @@ class City(Drawable):
         Returns a list containing the shortest path between 'start' and 'end' and the total
         distance between the two places
 
-        Based on the Dijkstra’s Shortest Path Algorithm
+        Based on the Dijkstra’s Shortest Path Algorithm, using a binary heap with lazy deletion
+        so a query runs in O((V + E) log V) time.
 
         Preconditions:
             - 0 <= start[0] <= WIDTH and 0 <= start[1] <= HEIGHT
@@ -546,66 +679,132 @@ class City(Drawable):
         if start == end:
             return ([], 0)
 
-        visited = set()
-        unvisited = self.get_all_places().union(self.get_all_bus_stops())
+        distances, predecessor = self._dijkstra(start, {end})
+        return self._build_path(distances, predecessor, end)
 
-        distances = {place: float('inf') for place in unvisited}
-        distances[start] = 0
+    def shortest_path_tree(self, source: tuple[float, float]) -> tuple[dict, dict]:
+        """
+        Return the shortest path tree from 'source' as a tuple of (distances, predecessor).
 
-        predecessor = {place: None for place in unvisited}
+        distances maps the position of every place reachable from 'source' to its shortest
+        distance from 'source', and predecessor maps it to the position of the place before it
+        on that shortest path (None for 'source' itself).
 
-        while end not in visited:
-            curr = min(unvisited, key=lambda place: distances[place])
+        Preconditions:
+            - 0 <= source[0] <= WIDTH and 0 <= source[1] <= HEIGHT
+        """
+        if source not in self._places and source not in self._bus_stops[0]:
+            raise ValueError
+        return self._dijkstra(source)
 
-            # If the shortest distance is inf, then there is no path
-            if distances[curr] == float('inf'):
-                break
+    def dijkstra_paths(self, source: tuple[float, float], targets: list) -> dict:
+        """
+        Return a dictionary mapping every position in <targets> to the shortest path from
+        'source' to it, in the same format as dijkstra_path.
 
-            for neighbour in self.get_neighbours(curr):
-                new_dist = distances[curr] + self.get_distance(curr, neighbour)
-                if neighbour not in visited and new_dist < distances[neighbour]:
-                    distances[neighbour] = new_dist
-                    predecessor[neighbour] = curr
+        Only one search is done, which stops as soon as every target has been reached.
 
-            visited.add(curr)
-            unvisited.remove(curr)
+        Preconditions:
+            - 0 <= source[0] <= WIDTH and 0 <= source[1] <= HEIGHT
+            - all(0 <= target[0] <= WIDTH and 0 <= target[1] <= HEIGHT for target in targets)
+        """
+        if source not in self._places and source not in self._bus_stops[0]:
+            raise ValueError
+        if any(target not in self._places and target not in self._bus_stops[0]
+               for target in targets):
+            raise ValueError
 
-        # Printing the shortest path in the form of a list
-        shortest_path = []
-        curr = end
-        if curr not in predecessor:
-            predecessor[curr] = None
+        distances, predecessor = self._dijkstra(source, set(targets) - {source})
 
-        while predecessor[curr] is not None:
-            shortest_path.insert(0, curr)
-            curr = predecessor[curr]
+        paths = {}
+        for target in targets:
+            if target == source:
+                paths[target] = ([], 0)
+            else:
+                paths[target] = self._build_path(distances, predecessor, target)
+        return paths
 
-        if shortest_path != []:
-            shortest_path.insert(0, curr)
-        else:
+    def _dijkstra(self, start: tuple[float, float], targets: Optional[set] = None) \
+            -> tuple[dict, dict]:
+        """
+        Run Dijkstra's algorithm from 'start' and return a tuple of (distances, predecessor),
+        two dictionaries mapping the position of every reached vertex to its shortest distance
+        from 'start' and to the position of the vertex before it on that path.
+
+        The search stops as soon as every position in <targets> has been settled. If <targets>
+        is None, the full shortest path tree is computed.
+
+        Entries in the heap are never decreased in place; instead a new entry is pushed and
+        stale entries are skipped when they are popped (lazy deletion).
+
+        Preconditions:
+            - start in self._places or start in self._bus_stops[0]
+        """
+        distances = {start: 0}
+        predecessor = {start: None}
+        settled = set()
+        remaining = None if targets is None else set(targets)
+
+        counter = itertools.count()  # Breaks ties so _Place objects are never compared
+        heap = [(0, next(counter), self._get_place(start))]
+
+        while heap:
+            dist, _, place = heapq.heappop(heap)
+            if place.pos in settled:
+                continue
+            settled.add(place.pos)
+
+            if remaining is not None:
+                remaining.discard(place.pos)
+                if not remaining:
+                    break
+
+            for neighbour, weight in place.neighbours.items():
+                new_dist = dist + weight
+                if neighbour.pos not in settled and \
+                        new_dist < distances.get(neighbour.pos, float('inf')):
+                    distances[neighbour.pos] = new_dist
+                    predecessor[neighbour.pos] = place.pos
+                    heapq.heappush(heap, (new_dist, next(counter), neighbour))
+
+        return distances, predecessor
+
+    @staticmethod
+    def _build_path(distances: dict, predecessor: dict, end: tuple[float, float]) -> tuple:
+        """
+        Return the path to 'end' described by the predecessor dictionary returned by
+        _dijkstra, in the same format as dijkstra_path.
+        """
+        if predecessor.get(end) is None:
             return ([], "No path exists!")
 
+        shortest_path = []
+        curr = end
+        while curr is not None:
+            shortest_path.append(curr)
+            curr = predecessor[curr]
+        shortest_path.reverse()
+
         return (shortest_path, round(distances[end], 2))
 
     def a_star_path(self, start: tuple[float, float], end: tuple[float, float],
-                    heuristic: callable) -> tuple:
+                    heuristic: callable = distance) -> tuple:
         """
-        Returns a list containing the shortest path (may not be the case; read below for more info)
-        between 'start' and 'end' and the total distance between the two places
+        Returns a list containing the shortest path between 'start' and 'end' and the total
+        distance between the two places
 
         Based on the A* Shortest Path Algorithm which is a 'smart' version of Dijkstra. It uses a
-        heuristic function to determine which nodes are better instead of traversing over every
-        node.
+        heuristic function to estimate the remaining distance to 'end', and always expands the
+        vertex with the smallest (distance so far + estimate) first.
 
         For A* to find the shortest path, the heuristic must not overestimate the
-        remaining distance to the end. With a city graph, there is no particular rule to how
-        streets and places must be placed (compared to a grid-based graph). As a such, basic
-        heuristic functions like 'distance','diagonal' or 'manhattan' in utility_functions.py may
-        overestimate the remaining distance. There are certainly custom heuristic functions out
-        there that provide far better estimates but they are way beyond the scope of this
-        project and course.
+        remaining distance to the end. Every street is as long as the straight line between its
+        endpoints, so the default 'distance' heuristic never does. 'manhattan' and 'diagonal'
+        in utility_functions.py may overestimate it, in which case the path returned is not
+        always the shortest one.
 
-        As such, this implementation of A* will not always give you the shortest path.
+        If prepare_landmarks has been called, the estimate is improved with the landmark
+        lower bounds (see _landmark_bound), which are also never an overestimate.
 
         Preconditions:
             - 0 <= start[0] <= WIDTH and 0 <= start[1] <= HEIGHT
@@ -617,49 +816,96 @@ class City(Drawable):
         if start == end:
             return ([], 0)
 
-        visited = set()
-        unvisited = self.get_all_places().union(self.get_all_bus_stops())
+        distances = {start: 0}
+        predecessor = {start: None}
+        settled = set()
 
-        costs = {place: float('inf') for place in unvisited}
-        costs[start] = 0
+        counter = itertools.count()  # Breaks ties so _Place objects are never compared
+        heap = [(self._estimate(start, end, heuristic), next(counter), self._get_place(start))]
 
-        distances = {place: 0 for place in unvisited}
-        predecessor = {place: None for place in unvisited}
+        while heap:
+            _, _, place = heapq.heappop(heap)
+            if place.pos in settled:
+                continue
+            settled.add(place.pos)
 
-        while end not in visited:
-            curr = min(unvisited, key=lambda place: costs[place])
-
-            # If the smallest cost is inf, then there is no path
-            if costs[curr] == float('inf'):
+            if place.pos == end:
                 break
 
-            for neighbour in self.get_neighbours(curr):
-                new_cost = costs[curr] + self.get_distance(curr, neighbour) + heuristic(curr, end)
-                if neighbour not in visited and new_cost < costs[neighbour]:
-                    costs[neighbour] = new_cost
-                    distances[neighbour] = distances[curr] + self.get_distance(curr, neighbour)
+            dist = distances[place.pos]
+            for neighbour, weight in place.neighbours.items():
+                new_dist = dist + weight
+                if neighbour.pos not in settled and \
+                        new_dist < distances.get(neighbour.pos, float('inf')):
+                    distances[neighbour.pos] = new_dist
+                    predecessor[neighbour.pos] = place.pos
+                    estimate = new_dist + self._estimate(neighbour.pos, end, heuristic)
+                    heapq.heappush(heap, (estimate, next(counter), neighbour))
 
-                    predecessor[neighbour] = curr
+        return self._build_path(distances, predecessor, end)
 
-            visited.add(curr)
-            unvisited.remove(curr)
+    def _estimate(self, pos: tuple[float, float], end: tuple[float, float],
+                  heuristic: callable) -> float:
+        """
+        Return the A* estimate of the remaining distance from pos to end: the larger of
+        heuristic(pos, end) and the landmark lower bound, if landmarks have been prepared.
+        """
+        if self._landmarks:
+            return max(heuristic(pos, end), self._landmark_bound(pos, end))
+        return heuristic(pos, end)
 
-        # Printing the shortest path in the form of a list
-        shortest_path = []
-        curr = end
-        if curr not in predecessor:
-            predecessor[curr] = None
+    def prepare_landmarks(self, k: int) -> None:
+        """
+        Pick k landmarks and store the shortest distance from each landmark to every place
+        (the ALT preprocessing step). Repeated a_star_path queries on this city then use
+        these distances to explore far fewer places.
 
-        while predecessor[curr] is not None:
-            shortest_path.insert(0, curr)
-            curr = predecessor[curr]
+        Landmarks are picked one at a time, each being the place that is furthest (by
+        shortest path distance) from the landmarks picked so far, so that they end up spread
+        around the edges of the city.
 
-        if shortest_path != []:
-            shortest_path.insert(0, curr)
-        else:
-            return ([], "No path exists!")
+        The landmarks are discarded as soon as the city changes (see _graph_changed), since
+        the stored distances may then be out of date.
 
-        return (shortest_path, round(distances[end], 2))
+        Preconditions:
+            - k >= 0
+        """
+        self._landmarks = dict()
+        positions = self.get_all_places().union(self.get_all_bus_stops())
+        if not positions or k == 0:
+            return
+
+        # Start from the place furthest from an arbitrary one
+        closest = self._dijkstra(min(positions))[0]
+
+        while len(self._landmarks) < k:
+            candidates = [pos for pos in closest if pos not in self._landmarks]
+            if not candidates:
+                break
+            landmark = max(candidates, key=lambda pos: closest[pos])
+
+            landmark_distances = self._dijkstra(landmark)[0]
+            self._landmarks[landmark] = landmark_distances
+
+            # Distance from every place to its closest landmark so far
+            if len(self._landmarks) == 1:
+                closest = landmark_distances.copy()
+            else:
+                for pos, dist in landmark_distances.items():
+                    closest[pos] = min(closest.get(pos, dist), dist)
+
+    def _landmark_bound(self, pos: tuple[float, float], end: tuple[float, float]) -> float:
+        """
+        Return a lower bound of the shortest distance between pos and end using the landmarks.
+
+        By the triangle inequality, for any landmark L, d(pos, end) >= |d(L, end) - d(L, pos)|.
+        Landmarks that cannot reach both places are skipped.
+        """
+        bound = 0
+        for landmark_distances in self._landmarks.values():
+            if pos in landmark_distances and end in landmark_distances:
+                bound = max(bound, abs(landmark_distances[end] - landmark_distances[pos]))
+        return bound
 
     # ========================================================
     # Bus stop algorithms
@@ -684,19 +930,8 @@ class City(Drawable):
         projections = []
 
         for bus_stop in bus_stops:
-            min_dist = float('inf')
-            bus_stop_proj = None
-            target_street = None
-
             # Calculating closest street
-            for street in self._streets:
-                proj = projection(street[0], street[1], bus_stop)
-                dist = distance(bus_stop, proj)
-                if dist < min_dist:
-                    min_dist = dist
-                    bus_stop_proj = proj
-                    target_street = street
-
+            target_street, bus_stop_proj = self._nearest_street(bus_stop)
             bus_stops_so_far.append((bus_stop_proj, target_street))
 
         for bus_stop_proj, target_street in bus_stops_so_far:
@@ -720,6 +955,7 @@ class City(Drawable):
                     self.delete_street(p1, p2)
                     self.add_street(p1, bus_stop_proj)
                     self.add_street(p2, bus_stop_proj)
+                    self._bus_stop_splits[bus_stop_proj] = (p1, p2)
                     projections.append(bus_stop_proj)
                 else:
                     projections.append(None)
@@ -728,50 +964,237 @@ class City(Drawable):
 
         return projections
 
-    def get_bus_stops_num(self) -> int:
+    def _nearest_street(self, pos: tuple[float, float]) -> tuple:
+        """
+        Return a tuple of (street, projection) for the street closest to pos and the projection
+        of pos onto it, or (None, None) if there are no streets.
+
+        Only the streets in the grid cells around pos are looked at (see GridIndex.nearest),
+        and they are projected onto together with batch_projection.
+        """
+        def distances_to(streets: list) -> np.ndarray:
+            starts = [street[0] for street in streets]
+            ends = [street[1] for street in streets]
+            return batch_projection([pos], starts, ends)[1][0]
+
+        street, _ = self._street_index.nearest(pos, distances_to)
+
+        if street is None:
+            return None, None
+        return street, projection(street[0], street[1], pos)
+
+    def get_bus_stops_num(self, processes: Optional[int] = None,
+                          random_state: Optional[int] = None, incremental: bool = False,
+                          mode: str = 'full', chunk_size: int = 10000,
+                          weights: Optional[dict] = None, cell_size: float = 20) -> int:
         """
         Find the k value in which an "elbow" appears (where a large increase in the variation
         of inertia is seen)
         For more info, please look at https://www.youtube.com/watch?v=4b5d3muPQmA
+
+        Every k is scored on a snapshot of the city (see score_bus_stops in snapshot.py), so
+        the city itself is only changed once at the end, when the bus stops for the chosen k
+        are placed. The k values are scored <processes> at a time in a process pool
+        (os.cpu_count() of them if processes is None, or in this process if processes == 1),
+        stopping after the first batch in which the elbow is found.
+
+        If incremental is True, the clustering for every k is instead warm started from the
+        clustering for k - 1 (see incremental_clusterings in snapshot.py), which is much
+        cheaper than clustering from scratch but has to be done one k after another in this
+        process, and does not use weights. Otherwise the places are clustered with the given
+        mode, chunk_size, weights and cell_size (see _get_bus_stops), and the weights are used
+        in every mode.
+
+        No k greater than the number of places is scored, even when a whole batch of k values
+        is scored past the elbow.
+
+        Preconditions:
+            - len(self._places) >= 2
+        """
+        snapshot = self.snapshot(weights)
+        score = functools.partial(score_bus_stops, snapshot, mode=mode, chunk_size=chunk_size,
+                                  cell_size=cell_size)
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        layouts = {}  # k -> (inertia, centers)
+        ks = list(range(2, min(30, len(self._places)) + 1))
+        chosen_k = None
+
+        if incremental:
+            clusterings = incremental_clusterings(snapshot.place_coords, ks[0], ks[-1],
+                                                  random_state)
+            for k, centers in clusterings:
+                layouts[k] = score_centers(snapshot, centers)
+                chosen_k = _find_elbow([layouts[j][0] for j in range(2, k + 1)])
+                if chosen_k is not None:
+                    break
+        elif processes == 1:
+            for k in ks:
+                layouts[k] = score(k, random_state)
+                chosen_k = _find_elbow([layouts[j][0] for j in range(2, k + 1)])
+                if chosen_k is not None:
+                    break
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                for lo in range(0, len(ks), processes):
+                    batch = ks[lo:lo + processes]
+                    results = pool.map(score, batch, [random_state] * len(batch))
+                    layouts.update(zip(batch, results))
+
+                    chosen_k = _find_elbow([layouts[j][0] for j in range(2, batch[-1] + 1)])
+                    if chosen_k is not None:
+                        break
+
+        if chosen_k is None:
+            # If no local max exist, return a default value
+            chosen_k = min(3, ks[-1])
+
+        self.place_bus_stops(layouts[chosen_k][1])
+        return chosen_k
+
+    def optimize_bus_stops(self, k: int, restarts: int = 100, processes: Optional[int] = None,
+                           patience: int = 5, time_budget: Optional[float] = None,
+                           random_state: Optional[int] = None, mode: str = 'full',
+                           chunk_size: int = 10000, weights: Optional[dict] = None,
+                           cell_size: float = 20) -> float:
+        """
+        Try up to <restarts> clusterings of the places into k clusters, each with its own seed,
+        replace the bus stops with the best layout found and return its inertia (or -1.0 if no
+        layout could be projected onto the streets). The inertia is also saved with
+        change_inertia.
+
+        Every layout is scored on a snapshot of the city by its inertia after projection (see
+        score_bus_stops in snapshot.py), <processes> at a time in a process pool (as in
+        get_bus_stops_num). The search stops early once <patience> layouts in a row have not
+        beaten the best one, or once <time_budget> seconds have passed. Results are looked at in
+        seed order, so the same random_state always gives the same layout. The places are
+        clustered with the given mode, chunk_size, weights and cell_size (see _get_bus_stops),
+        and the weights are used in every mode.
+
+        Preconditions:
+            - 1 <= k <= len(self._places)
+            - restarts >= 1
+            - patience >= 1
+        """
+        snapshot = self.snapshot(weights)
+        score = functools.partial(score_bus_stops, snapshot, mode=mode, chunk_size=chunk_size,
+                                  cell_size=cell_size)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if random_state is None:
+            random_state = random.randrange(2 ** 31)
+
+        seeds = list(range(random_state, random_state + restarts))
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+
+        best_inertia, best_centers = -1.0, None
+        since_improved = 0
+
+        pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        try:
+            for lo in range(0, len(seeds), processes):
+                batch = seeds[lo:lo + processes]
+                if pool is None:
+                    results = [score(k, seed) for seed in batch]
+                else:
+                    results = pool.map(score, [k] * len(batch), batch)
+
+                for inertia, centers in results:
+                    if inertia != -1.0 and (best_centers is None or inertia < best_inertia):
+                        best_inertia, best_centers = inertia, centers
+                        since_improved = 0
+                    else:
+                        since_improved += 1
+
+                if since_improved >= patience or \
+                        (deadline is not None and time.monotonic() >= deadline):
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if best_centers is None:
+            return -1.0
+
+        inertia = self.place_bus_stops(best_centers)
+        self.change_inertia(inertia)
+        return inertia
+
+    def snapshot(self, weights: Optional[dict] = None) -> CitySnapshot:
+        """Return a read-only copy of the places and streets in this city, as arrays. The
+        streets are the ones the city would have after clear_bus_stops, but the city itself is
+        not changed.
+
+        weights, if given, maps the position of every place to its weight when clustering
+        (for example ModelCity.place_weights()).
+        """
+        place_coords = np.array(list(self._places), dtype=np.float64).reshape(-1, 2)
+        streets = list(self._streets_without_bus_stops())
+
+        place_weights = None
+        if weights is not None:
+            place_weights = np.array([weights[pos] for pos in self._places], dtype=np.float64)
+
+        return CitySnapshot(
+            place_coords,
+            np.array([street[0] for street in streets], dtype=np.float64).reshape(-1, 2),
+            np.array([street[1] for street in streets], dtype=np.float64).reshape(-1, 2),
+            np.array([street[0] in self._places and street[1] in self._places
+                      for street in streets], dtype=bool),
+            place_weights)
+
+    def _streets_without_bus_stops(self) -> set[tuple[tuple, tuple]]:
+        """Return the streets of this city with every split made by a bus stop undone, as
+        clear_bus_stops would leave them
         """
-        k = 2
-        inertias = []
-        variation = []
-        change_in_variation = []  # We want to find the largest change in variation
-
-        while True:
-            inertias.append(self.add_bus_stops(k))
-            if len(inertias) >= 2:
-                variation.append(inertias[k - 2] - inertias[k - 3])
-            if len(variation) >= 2:
-                change_in_variation.append(variation[k - 3] - variation[k - 4])
-            l_max = local_max(change_in_variation)
-            if len(l_max) == 1:
-                # So now a local max is found; this must be the element in
-                # change_in_variation[len(change_in_variation) - 2].
-                # Naturally this change in variation corresponds to the
-                # difference in "variation of inertia of k = len(inertias) and inertia of
-                # k = len(inertias) - 1" and "variation of inertia of k = len(inertias) - 1
-                # and inertia of k = len(inertias) - 2", and so we return k = len(inertias) - 1
-                return len(inertias) - 1
-            elif k == 30:
-                # If no local max exist, return a default value
-                return 3
-            k += 1
-
-    def _get_bus_stops(self, n_clusters: int) -> list[list[tuple], list]:
-        """Return a set of bus stop coordinates calculated using KMeans clustering algorithm
-        """
-
-        temp = [list(x) for x in self.get_all_places()]
-        df = pd.DataFrame(temp)
-
-        km = KMeans(n_clusters=n_clusters, init='k-means++')
-        km.fit_predict(df)
-        centers = km.cluster_centers_
-
-        # km.inertia_ is the original inertia with the auto generated centroid
-        return [list(map(tuple, centers)), temp]
+        streets = set(self._streets)
+        for pos, bus_stop in self._bus_stops[0].items():
+            if pos in self._places:
+                continue
+
+            for neighbour in bus_stop.neighbours:
+                streets.discard((pos, neighbour.pos))
+                streets.discard((neighbour.pos, pos))
+
+            original_street = self._split_street(pos)
+            if original_street is not None and \
+                    (original_street[1], original_street[0]) not in streets:
+                streets.add(original_street)
+
+        return streets
+
+    def _get_bus_stops(self, n_clusters: int, mode: str = 'full', chunk_size: int = 10000,
+                       weights: Optional[dict] = None,
+                       cell_size: float = 20) -> list[list[tuple], np.ndarray]:
+        """Return a list of [bus stop coordinates, place coordinates], where the bus stop
+        coordinates are calculated using KMeans clustering algorithm
+
+        mode == 'full' runs KMeans on every place at once, and mode == 'minibatch' streams the
+        places through mini-batch k-means chunk_size at a time, which scales to millions of
+        places. mode == 'binned' groups the places into grid cells of side cell_size and runs
+        KMeans on the cells, weighted by the summed weights of their places. See cluster_places
+        in snapshot.py.
+
+        weights, if given, maps the position of every place to its weight (for example
+        ModelCity.place_weights()). The weights are used in every mode: as sample weights
+        in 'full', for the weighted means of the chunks in 'minibatch', and summed per cell in
+        'binned'.
+
+        Preconditions:
+            - mode in {'full', 'minibatch', 'binned'}
+            - weights is None or all(pos in weights for pos in self._places)
+        """
+        temp = np.array(list(self._places), dtype=np.float64).reshape(-1, 2)
+
+        place_weights = None
+        if weights is not None:
+            place_weights = np.array([weights[pos] for pos in self._places], dtype=np.float64)
+
+        centers = cluster_places(temp, n_clusters, mode=mode, chunk_size=chunk_size,
+                                 weights=place_weights, cell_size=cell_size)
+
+        return [centers, temp]
 
     def calculate_inertia(self, place_coords: list, centers: list) -> float:
         """
@@ -793,24 +1216,50 @@ class City(Drawable):
             - all(0 <= center[0] <= WIDTH for center in centers)
             - all(0 <= center[1] <= HEIGHT for center in centers)
         """
-        inertia = 0.0
-        for e in range(len(place_coords)):
-            distances = []
-            for i in range(len(centers)):
-                distances.append(distance(tuple(place_coords[e]), centers[i]))
-            inertia += min(distances) ** 2
-        return inertia
+        return self.calculate_inertia_and_assignment(place_coords, centers)[0]
+
+    def calculate_inertia_and_assignment(self, place_coords: list, centers: list) \
+            -> tuple[float, np.ndarray]:
+        """
+        Return a tuple of (inertia, assignment), where inertia is the same as in
+        calculate_inertia and assignment[i] is the index of the center closest to
+        place_coords[i].
 
-    def add_bus_stops(self, num: int) -> float:
+        The distances are computed with numpy (see nearest_centers in utility_functions.py),
+        using a KD-tree of the centers when there are many of them.
+
+        Preconditions:
+            - all(place in self._places for place in place_coords)
+            - len(centers) > 0
+        """
+        squared_distances, assignment = nearest_centers(place_coords, centers)
+        return float(squared_distances.sum()), assignment
+
+    def add_bus_stops(self, num: int, mode: str = 'full', chunk_size: int = 10000,
+                      weights: Optional[dict] = None, cell_size: float = 20) -> float:
         """Return the inertia of the bus system
+
+        mode, chunk_size, weights and cell_size are passed to _get_bus_stops.
+        """
+        km_parameters = self._get_bus_stops(num, mode, chunk_size, weights, cell_size)
+        return self.place_bus_stops(km_parameters[0], km_parameters[1])
+
+    def place_bus_stops(self, centers: list[tuple], place_coords: list = None) -> float:
         """
-        km_parameters = self._get_bus_stops(num)
-        bus_stops = km_parameters[0]
+        Replace the bus stops with the projections of the given cluster centers onto the
+        streets, and return the inertia of the new bus system (or -1.0 if a center could not
+        be projected).
+
+        place_coords defaults to the coordinates of every place in the city.
+        """
+        if place_coords is None:
+            place_coords = list(self._places)
+
         self.clear_bus_stops()
-        projected_centers = self._bus_stop_projections(bus_stops)
+        projected_centers = self._bus_stop_projections(centers)
 
         if None not in projected_centers:
-            return self.calculate_inertia(km_parameters[1], projected_centers)
+            return self.calculate_inertia(place_coords, projected_centers)
         else:
             return -1.0
 
@@ -834,24 +1283,54 @@ class City(Drawable):
             - 0 <= m_pos[1] <= HEIGHT
         """
         # First see if the mouse is on a place
-        for place_pos in self._places:
+        for place_pos in self._place_index.query_point(m_pos):
             place = self._places[place_pos]
             if place.pos_on_place(m_pos):
                 return place_pos, "Place"
 
         # Second see if the mouse is on a bus stop
-        for bus_pos in self._bus_stops[0]:
+        for bus_pos in self._bus_stop_index.query_point(m_pos):
             bus_stop = self._bus_stops[0][bus_pos]
             if bus_stop.pos_on_place(m_pos):
                 return bus_pos, "Bus Stop"
 
         # If not a place, then check if it's on a street
-        for street in self._streets:
+        for street in self._street_index.query_point(m_pos):
             if self.pos_on_street(street, m_pos):
                 return street, "Street"
 
         return None, None  # The mouse is on nothing
 
+    @staticmethod
+    def _place_box(place: _Place) -> tuple[float, float, float, float]:
+        """
+        Return the bounding box (min x, min y, max x, max y) of the square drawn for the given
+        place or bus stop.
+        """
+        x, y = place.pos
+        return (x - place.WIDTH // 2, y - place.WIDTH // 2,
+                x + place.WIDTH // 2, y + place.WIDTH // 2)
+
+    def _street_box(self, street: tuple[tuple, tuple]) -> tuple[float, float, float, float]:
+        """
+        Return a bounding box (min x, min y, max x, max y) of every mouse position for which
+        pos_on_street(street, m_pos) is True.
+
+        These positions form an ellipse with the endpoints of the street as foci, whose
+        semi-minor axis is half of sqrt(2 * length * threshold + threshold ** 2). The ellipse
+        never reaches further than that from the street in any direction.
+
+        Preconditions:
+            - street in self._streets
+        """
+        threshold = self.STREET_WIDTH // 2
+        a, b = street
+        length = distance(a, b)
+        pad = math.sqrt(2 * length * threshold + threshold ** 2) / 2
+
+        return (min(a[0], b[0]) - pad, min(a[1], b[1]) - pad,
+                max(a[0], b[0]) + pad, max(a[1], b[1]) + pad)
+
     def pos_on_street(self, street: tuple[tuple, tuple], m_pos: tuple[int, int]) -> bool:
         """
         Given a street (pair of coordinates) and mouse position <m_pos>, determine if the mouse
@@ -875,38 +1354,43 @@ class City(Drawable):
 
         return abs(summed - street_length) <= threshold
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this item within the pygame window
-        """
-        # Loop through the streets to draw them
-        for street in self._streets:
-            self._draw_street(street, screen)
-
-        # Loop through the places to draw them
-        for pos in self._places:
-            place = self._places[pos]
-            place.draw(screen)
-
-        # Loop through the bus stops to draw them
-        for pos in self._bus_stops[0]:
-            place = self._bus_stops[0][pos]
-            place.draw(screen)
-
-    def _draw_street(self, street: tuple[tuple, tuple], screen: pygame.Surface) -> None:
-        """
-        A helper method to draw a street (a line) between two positions on a screen.
 
-        Preconditions:
-            - street in self._streets
-        """
-        pygame.draw.line(screen, STREET, street[0], street[1], self.STREET_WIDTH)
+def _find_elbow(inertias: list[float]) -> Optional[int]:
+    """
+    Return the number of bus stops at which an elbow appears in the given inertias for
+    k = 2, 3, ..., or None if there is none yet. This replays the search in
+    City.get_bus_stops_num one k at a time, so the elbow returned is the one that a one by one
+    search would have stopped at.
+    """
+    variation = []
+    change_in_variation = []  # We want to find the largest change in variation
+
+    for n in range(1, len(inertias) + 1):
+        # n is how many inertias the one by one search would have calculated so far
+        if n >= 2:
+            variation.append(inertias[n - 1] - inertias[n - 2])
+        if len(variation) >= 2:
+            change_in_variation.append(variation[n - 2] - variation[n - 3])
+        l_max = local_max(change_in_variation)
+        if len(l_max) == 1:
+            # So now a local max is found; this must be the element in
+            # change_in_variation[len(change_in_variation) - 2].
+            # Naturally this change in variation corresponds to the
+            # difference in "variation of inertia of k = len(inertias) and inertia of
+            # k = len(inertias) - 1" and "variation of inertia of k = len(inertias) - 1
+            # and inertia of k = len(inertias) - 2", and so we return k = len(inertias) - 1
+            return n - 1
+
+    return None
+
+
+def convert_text_to_binary(map_file: str, bus_file: str, city_file: str) -> None:
+    """Convert a city saved by City.export_to_file into the format of City.export_to_binary
+    """
+    City.build_from_file(map_file, bus_file).export_to_binary(city_file)
 
-    def draw_highlighted_street(self, street: tuple[tuple, tuple], screen: pygame.Surface,
-                                colour: tuple) -> None:
-        """
-        A helper method to draw a highlighted street (a line) between two positions on a screen.
 
-        Preconditions:
-            - street in self._streets
-        """
-        pygame.draw.line(screen, colour, street[0], street[1], self.STREET_WIDTH)
+def convert_binary_to_text(city_file: str, map_file: str, bus_file: str) -> None:
+    """Convert a city saved by City.export_to_binary into the format of City.export_to_file
+    """
+    City.build_from_binary(city_file).export_to_file(map_file, bus_file)
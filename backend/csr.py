@@ -0,0 +1,141 @@
+""" CSC111 Final Project: Bus Stop Creator
+csr.py
+
+================================================================================
+This file contains a compact, array based representation of the City graph.
+  - CSRGraph
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+
+A CSRGraph is usually obtained through City.to_csr(), which keeps it in sync with the
+city:
+
+graph = city.to_csr()
+graph.shortest_path((437, 256), (609, 273))
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_matrix
+
+PLACE_KIND = 0
+INTERSECTION_KIND = 1
+BUS_STOP_KIND = 2
+
+
+class CSRGraph:
+    """The City graph stored in compressed sparse row (CSR) form.
+
+    Every vertex of the city (place, intersection or bus stop) is given an integer id. The
+    neighbours of vertex i are indices[indptr[i]:indptr[i + 1]], and the lengths of the
+    streets to them are weights[indptr[i]:indptr[i + 1]].
+
+    Instance Attributes:
+        - positions: The coordinates of every vertex, indexed by id
+        - ids: A dictionary mapping the coordinates of every vertex to its id
+        - coords: An array of shape (n, 2) with the coordinates of every vertex
+        - kinds: The kind of every vertex (PLACE_KIND, INTERSECTION_KIND or BUS_STOP_KIND)
+        - indptr: An array of length n + 1 giving where each vertex's neighbours start
+        - indices: The ids of the neighbours of every vertex, one after another
+        - weights: The length of the street to each neighbour in indices
+
+    Representation Invariants:
+        - len(self.positions) == len(self.ids) == len(self.coords) == len(self.kinds)
+        - len(self.indptr) == len(self.positions) + 1
+        - len(self.indices) == len(self.weights) == self.indptr[-1]
+    """
+    positions: list[tuple]
+    ids: dict[tuple, int]
+    coords: np.ndarray
+    kinds: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+    def __init__(self, positions: list[tuple], kinds: np.ndarray, indptr: np.ndarray,
+                 indices: np.ndarray, weights: np.ndarray) -> None:
+        self.positions = positions
+        self.ids = {pos: i for i, pos in enumerate(positions)}
+        self.coords = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.kinds = kinds
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    def num_vertices(self) -> int:
+        """Return the number of vertices in this graph
+        """
+        return len(self.positions)
+
+    def neighbours(self, i: int) -> np.ndarray:
+        """Return the ids of the neighbours of vertex i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def place_coords(self) -> np.ndarray:
+        """Return the coordinates of every vertex that is not only a bus stop, as an array of
+        shape (n, 2). These are the points that the bus stops are clustered around.
+        """
+        return self.coords[self.kinds != BUS_STOP_KIND]
+
+    def to_sparse(self) -> csr_matrix:
+        """Return this graph as a scipy sparse matrix
+        """
+        # scipy is slow to import, so it is only imported once it is needed
+        from scipy.sparse import csr_matrix
+
+        n = self.num_vertices()
+        return csr_matrix((self.weights, self.indices, self.indptr), shape=(n, n))
+
+    # ========================================================
+    # Pathfinding algorithms
+    # ========================================================
+
+    def shortest_path_tree(self, source: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the shortest path tree from vertex 'source' as a tuple of (distances,
+        predecessor) arrays. Unreachable vertices have a distance of inf and, like 'source'
+        itself, a negative predecessor.
+
+        Preconditions:
+            - 0 <= source < self.num_vertices()
+        """
+        from scipy.sparse.csgraph import dijkstra
+
+        distances, predecessor = dijkstra(self.to_sparse(), directed=False, indices=source,
+                                          return_predecessors=True)
+        return distances, predecessor
+
+    def shortest_path(self, start: tuple[float, float], end: tuple[float, float]) -> tuple:
+        """
+        Return the shortest path between the places at 'start' and 'end' in the same format
+        as City.dijkstra_path
+        """
+        if start not in self.ids or end not in self.ids:
+            raise ValueError
+        if start == end:
+            return ([], 0)
+
+        distances, predecessor = self.shortest_path_tree(self.ids[start])
+        return self.build_path(distances, predecessor, self.ids[end])
+
+    def build_path(self, distances: np.ndarray, predecessor: np.ndarray, end: int) -> tuple:
+        """
+        Return the path to vertex 'end' described by the arrays returned by
+        shortest_path_tree, in the same format as City.dijkstra_path.
+        """
+        if predecessor[end] < 0:
+            return ([], "No path exists!")
+
+        shortest_path = []
+        curr = end
+        while curr >= 0:
+            shortest_path.append(self.positions[curr])
+            curr = predecessor[curr]
+        shortest_path.reverse()
+
+        return (shortest_path, round(float(distances[end]), 2))
+
@@ -0,0 +1,303 @@
+""" CSC111 Final Project: Bus Stop Creator
+map_reader.py
+
+================================================================================
+This file contains a streaming reader for the .txt files written by
+City.export_to_file. Instead of adding every place and street to a City as it
+is read, the lines are parsed a chunk at a time into numpy arrays, and the
+streets are matched to their endpoints all at once when the file has been read.
+  - MapFormatError
+  - read_bus_file
+  - read_map_file
+  - read_csr
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+
+place_coords, place_kinds, edges = read_map_file("data/map.txt", bus_stop_coords)
+city = City.build_from_arrays(place_coords, place_kinds, bus_stop_coords, edges)
+"""
+from __future__ import annotations
+from typing import Iterator, Optional
+
+import itertools
+
+import numpy as np
+
+from backend.csr import CSRGraph, PLACE_KIND, INTERSECTION_KIND, BUS_STOP_KIND
+
+PLACE_KINDS = {'place': PLACE_KIND, 'intersection': INTERSECTION_KIND}
+
+
+class MapFormatError(ValueError):
+    """Raised when a line of a map or bus file cannot be read
+
+    Instance Attributes:
+        - path: The file that the line is in
+        - line_number: The number of the line, counting from 1
+        - line: The line itself
+    """
+    path: str
+    line_number: int
+    line: str
+
+    def __init__(self, path: str, line_number: int, line: str, reason: str) -> None:
+        super().__init__(f'{path}, line {line_number}: {reason}: {line.strip()!r}')
+        self.path = path
+        self.line_number = line_number
+        self.line = line
+
+
+def read_bus_file(bus_file: str) -> tuple[np.ndarray, list[list[tuple]], float]:
+    """Return the bus stop coordinates (as an (b, 2) int64 array), bus routes and inertia
+    saved in the given bus file.
+
+    Raise a MapFormatError if any line of the file cannot be read.
+    """
+    bus_stops = []
+    routes = []
+    inertia = -1.0
+
+    with open(bus_file, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            parsed_line = line.split()
+
+            try:
+                if not parsed_line:
+                    continue
+                elif parsed_line[0] == 'bus_stop' and len(parsed_line) == 3:
+                    bus_stops.append((int(parsed_line[1]), int(parsed_line[2])))
+                elif parsed_line[0] == 'inertia' and len(parsed_line) == 2:
+                    inertia = float(parsed_line[1])
+                elif len(parsed_line) % 2 == 0:
+                    values = [int(value) for value in parsed_line]
+                    routes.append(list(zip(values[::2], values[1::2])))
+                else:
+                    raise MapFormatError(bus_file, line_number, line, 'unrecognised line')
+            except MapFormatError:
+                raise
+            except ValueError:
+                raise MapFormatError(bus_file, line_number, line, 'expected integer coordinates')
+
+    return np.array(bus_stops, dtype=np.int64).reshape(-1, 2), routes, inertia
+
+
+def read_map_file(map_file: str, bus_stop_coords: Optional[np.ndarray] = None,
+                  chunk_size: int = 65536) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the places and streets saved in the given map file as the place_coords,
+    place_kinds and edges arrays taken by City.build_from_arrays.
+
+    The file is read chunk_size lines at a time. Streets may appear before, after or
+    between the places they connect, and may end at any of the given bus stops. If a
+    position appears more than once as a place, only its first appearance is kept (as in
+    City.add_place), and a street ending at a position that is both a place and a bus stop
+    is connected to the place (as in City.add_street).
+
+    Raise a MapFormatError, giving the line number, if a line cannot be read, or if a street
+    starts and ends at the same position or has an endpoint that is neither a place nor a
+    bus stop.
+
+    Preconditions:
+        - chunk_size > 0
+        - every coordinate is between -2 ** 31 and 2 ** 31 - 1
+    """
+    if bus_stop_coords is None:
+        bus_stop_coords = np.empty((0, 2), dtype=np.int64)
+
+    place_chunks = []
+    kind_chunks = []
+    street_chunks = []
+    street_line_chunks = []
+
+    with open(map_file, 'r') as f:
+        for first_line, lines in _chunks(f, chunk_size):
+            places, kinds, streets, street_lines = _parse_chunk(map_file, first_line, lines)
+            place_chunks.append(places)
+            kind_chunks.append(kinds)
+            street_chunks.append(streets)
+            street_line_chunks.append(street_lines)
+
+    place_coords = np.concatenate(place_chunks or [np.empty((0, 2), dtype=np.int64)])
+    place_kinds = np.concatenate(kind_chunks or [np.empty(0, dtype=np.int8)])
+    streets = np.concatenate(street_chunks or [np.empty((0, 4), dtype=np.int64)])
+    street_lines = np.concatenate(street_line_chunks or [np.empty(0, dtype=np.int64)])
+
+    # Keep the first appearance of every place, in the order they appear in the file
+    _, first = np.unique(_keys(place_coords), return_index=True)
+    first.sort()
+    place_coords, place_kinds = place_coords[first], place_kinds[first]
+
+    bus_stop_coords = np.asarray(bus_stop_coords, dtype=np.int64).reshape(-1, 2)
+    starts = _vertex_ids(place_coords, bus_stop_coords, streets[:, :2])
+    ends = _vertex_ids(place_coords, bus_stop_coords, streets[:, 2:])
+
+    bad = _first_bad_street(starts, ends)
+    if bad is not None:
+        line_number = int(street_lines[bad[0]])
+        raise MapFormatError(map_file, line_number, _line_at(map_file, line_number), bad[1])
+
+    return place_coords, place_kinds, np.stack([starts, ends], axis=1)
+
+
+def read_csr(map_file: str, bus_file: str, chunk_size: int = 65536) -> CSRGraph:
+    """Return the city saved in the given files in CSR form, the same as
+    City.build_from_file(map_file, bus_file).to_csr() up to the order of the vertices, but
+    without building a City.
+
+    Raise a MapFormatError if a line of either file cannot be read (see read_map_file).
+    """
+    bus_stop_coords, _, _ = read_bus_file(bus_file)
+    place_coords, place_kinds, edges = read_map_file(map_file, bus_stop_coords, chunk_size)
+
+    # A bus stop at the same position as a place becomes part of that place (as in to_csr)
+    n = len(place_coords)
+    kept = ~np.isin(_keys(bus_stop_coords), _keys(place_coords))
+    new_ids = np.concatenate([np.arange(n), n + np.cumsum(kept) - 1])
+    coords = np.concatenate([place_coords, bus_stop_coords[kept]])
+    kinds = np.concatenate([place_kinds, np.full(int(kept.sum()), BUS_STOP_KIND, np.int8)])
+
+    # Every street is stored once in each direction, without duplicates
+    edges = new_ids[edges]
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+
+    offsets = (coords[sources] - coords[targets]).astype(np.float64)
+    weights = np.sqrt(offsets[:, 0] * offsets[:, 0] + offsets[:, 1] * offsets[:, 1])
+    indptr = np.zeros(len(coords) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(coords)), out=indptr[1:])
+
+    positions = [tuple(pos) for pos in coords.tolist()]
+    return CSRGraph(positions, kinds, indptr, targets.astype(np.int32), weights)
+
+
+# ========================================================
+# Helpers
+# ========================================================
+
+def _chunks(f, chunk_size: int) -> Iterator[tuple[int, list[str]]]:
+    """Yield the lines of the open file f in lists of chunk_size lines, together with the
+    line number of the first line in each list
+    """
+    first_line = 1
+    while True:
+        lines = list(itertools.islice(f, chunk_size))
+        if not lines:
+            return
+        yield first_line, lines
+        first_line += len(lines)
+
+
+def _parse_chunk(path: str, first_line: int, lines: list[str]) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return the coordinates and kinds of the places, and the coordinates and line numbers of
+    the streets, in the given lines of a map file. first_line is the line number of lines[0].
+
+    The coordinates are converted to integers in bulk; a line is only looked at on its own
+    again if the chunk it is in fails to convert.
+    """
+    place_tokens = []
+    kinds = []
+    place_lines = []
+    street_tokens = []
+    street_lines = []
+
+    for line_number, line in enumerate(lines, first_line):
+        parsed_line = line.split()
+        if not parsed_line:
+            continue
+        elif parsed_line[0] in PLACE_KINDS and len(parsed_line) == 3:
+            place_tokens.extend(parsed_line[1:])
+            kinds.append(PLACE_KINDS[parsed_line[0]])
+            place_lines.append(line_number)
+        elif len(parsed_line) == 4:
+            street_tokens.extend(parsed_line)
+            street_lines.append(line_number)
+        else:
+            raise MapFormatError(path, line_number, line, 'unrecognised line')
+
+    places = _to_ints(path, first_line, lines, place_tokens, place_lines, 2)
+    streets = _to_ints(path, first_line, lines, street_tokens, street_lines, 4)
+    return places, np.array(kinds, dtype=np.int8), streets, np.array(street_lines, np.int64)
+
+
+def _to_ints(path: str, first_line: int, lines: list[str], tokens: list[str],
+             line_numbers: list[int], width: int) -> np.ndarray:
+    """Return the given tokens as an int64 array with width columns, where the i-th row came
+    from line line_numbers[i].
+
+    Raise a MapFormatError for the first line with a token that is not an integer.
+    """
+    try:
+        return np.array(tokens, dtype=np.int64).reshape(-1, width)
+    except ValueError:
+        for i, line_number in enumerate(line_numbers):
+            try:
+                [int(token) for token in tokens[i * width:(i + 1) * width]]
+            except ValueError:
+                raise MapFormatError(path, line_number, lines[line_number - first_line],
+                                     'expected integer coordinates')
+        raise
+
+
+def _keys(coords: np.ndarray) -> np.ndarray:
+    """Return a single int64 key for every row of the (n, 2) integer array coords, such that
+    two rows have the same key exactly when they have the same coordinates
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    return (coords[:, 0] << 32) | (coords[:, 1] & 0xFFFFFFFF)
+
+
+def _vertex_ids(place_coords: np.ndarray, bus_stop_coords: np.ndarray,
+                positions: np.ndarray) -> np.ndarray:
+    """Return the index of the vertex at every one of the given positions, where indices
+    0 to n - 1 are the n places and n onwards are the bus stops, or -1 where there is no
+    vertex. Places are preferred over bus stops at the same position.
+    """
+    ids = np.full(len(positions), -1, dtype=np.int64)
+    keys = _keys(positions)
+
+    for offset, coords in [(len(place_coords), bus_stop_coords), (0, place_coords)]:
+        vertex_keys = _keys(coords)
+        order = np.argsort(vertex_keys, kind='stable')
+        sorted_keys = vertex_keys[order]
+
+        found = np.searchsorted(sorted_keys, keys)
+        found[found == len(sorted_keys)] = 0
+        if len(sorted_keys) != 0:
+            matches = sorted_keys[found] == keys
+            ids[matches] = order[found[matches]] + offset
+
+    return ids
+
+
+def _first_bad_street(starts: np.ndarray, ends: np.ndarray) -> Optional[tuple[int, str]]:
+    """Return (index, reason) for the first street that cannot be added, given the vertex
+    ids of the starts and ends of the streets (-1 where there is no vertex), or None if every
+    street can be added
+
+    >>> _first_bad_street(np.array([0, 1]), np.array([1, 2])) is None
+    True
+    >>> _first_bad_street(np.array([0, 1]), np.array([1, 1]))
+    (1, 'street starts and ends at the same place')
+    >>> _first_bad_street(np.array([0, 1]), np.array([-1, 1]))
+    (0, 'street does not end at a place or bus stop')
+    >>> _first_bad_street(np.array([0, -1]), np.array([1, -1]))
+    (1, 'street does not end at a place or bus stop')
+    """
+    missing = (starts < 0) | (ends < 0)
+    bad = np.flatnonzero(missing | (starts == ends))
+    if len(bad) == 0:
+        return None
+    elif missing[bad[0]]:
+        return int(bad[0]), 'street does not end at a place or bus stop'
+    else:
+        return int(bad[0]), 'street starts and ends at the same place'
+
+
+def _line_at(path: str, line_number: int) -> str:
+    """Return the line with the given line number (counting from 1) in the file at path
+    """
+    with open(path, 'r') as f:
+        return next(itertools.islice(f, line_number - 1, None), '')
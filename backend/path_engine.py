@@ -0,0 +1,199 @@
+""" CSC111 Final Project: Bus Stop Creator
+path_engine.py
+
+================================================================================
+This file contains a shortest path engine that answers many path queries on a
+city at once, spread over a pool of worker processes.
+  - PathEngine
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+
+The arrays of the city's CSR form are copied into shared memory once, and every
+worker reads the graph from there, so the graph is never pickled per query.
+
+with PathEngine(city.to_csr(), processes=4) as engine:
+    paths = engine.shortest_paths([((437, 256), (609, 273)), ((609, 273), (246, 226))])
+"""
+from __future__ import annotations
+from typing import Optional
+
+import heapq
+import itertools
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backend.csr import CSRGraph
+
+# The (indptr, indices, weights) of the graph searched by a worker process, as memoryviews of
+# the shared memory blocks in _blocks, set by _attach
+_graph = None
+_blocks = []
+
+
+class PathEngine:
+    """Finds the shortest paths for batches of (source, target) queries on a CSRGraph.
+
+    The queries with the same source share one search. With more than one process, the
+    searches are shared out between a pool of worker processes that read the graph's
+    indptr, indices and weights arrays from shared memory. The paths are found with the same
+    search as City.dijkstra_path, visiting neighbours in the same order, so they are the same
+    paths that City.dijkstra_path returns no matter how many processes are used.
+
+    Instance Attributes:
+        - graph: The graph the paths are found in
+        - processes: The number of worker processes (1 means the searches run in this process)
+
+    Private Instance Attributes:
+        - _blocks: The shared memory blocks holding the graph's arrays
+        - _pool: The pool of worker processes, or None if processes == 1
+    """
+    graph: CSRGraph
+    processes: int
+    _blocks: list[shared_memory.SharedMemory]
+    _pool: Optional[ProcessPoolExecutor]
+
+    def __init__(self, graph: CSRGraph, processes: Optional[int] = None) -> None:
+        self.graph = graph
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        self._blocks = []
+        self._pool = None
+
+        if self.processes != 1:
+            handles = []
+            for array in (graph.indptr, graph.indices, graph.weights):
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+                self._blocks.append(block)
+                handles.append((block.name, array.shape, array.dtype.str))
+
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, initializer=_attach,
+                                             initargs=(handles,))
+
+    def __enter__(self) -> PathEngine:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the worker processes and free the shared memory
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def shortest_paths(self, queries: list[tuple[tuple, tuple]]) -> list[list[tuple]]:
+        """
+        Return the shortest path for every (source, target) query, in the same order as the
+        queries. Each path is a list of positions like the first item returned by
+        City.dijkstra_path: empty if the source and target are the same or no path exists.
+
+        Preconditions:
+            - all(source in self.graph.ids and target in self.graph.ids
+                  for source, target in queries)
+        """
+        ids = self.graph.ids
+        targets = {}  # source id -> target ids
+        for source, target in queries:
+            targets.setdefault(ids[source], dict())[ids[target]] = None
+
+        sources = list(targets)
+        target_lists = [list(targets[source]) for source in sources]
+
+        if self._pool is None:
+            views = tuple(memoryview(array) for array in
+                          (self.graph.indptr, self.graph.indices, self.graph.weights))
+            results = map(_search, sources, target_lists, itertools.repeat(views))
+        else:
+            chunk_size = max(1, len(sources) // (4 * self.processes))
+            results = self._pool.map(_search, sources, target_lists, chunksize=chunk_size)
+
+        paths = {}  # (source id, target id) -> path
+        for source, found in zip(sources, results):
+            for target, path in found.items():
+                paths[(source, target)] = [self.graph.positions[i] for i in path]
+
+        return [paths[(ids[source], ids[target])] for source, target in queries]
+
+
+# ========================================================
+# Functions run by the worker processes
+# ========================================================
+
+def _attach(handles: list[tuple[str, tuple, str]]) -> None:
+    """Open the shared memory blocks with the given (name, shape, dtype) handles in this
+    worker process, and search the graph through views of them. The blocks stay open until
+    the process exits, so the graph is never copied into the worker.
+    """
+    global _graph
+    views = []
+    for name, shape, dtype in handles:
+        block = shared_memory.SharedMemory(name=name)
+        _blocks.append(block)
+        views.append(memoryview(np.ndarray(shape, np.dtype(dtype), buffer=block.buf)))
+
+    _graph = tuple(views)
+
+
+def _search(source: int, targets: list[int],
+            graph: Optional[tuple[memoryview, memoryview, memoryview]] = None) \
+        -> dict[int, list[int]]:
+    """
+    Return a dictionary mapping every vertex in targets to the ids of the vertices on the
+    shortest path from source to it (empty if it is source or cannot be reached).
+
+    This is the search in City._dijkstra, run on the CSR arrays: it stops once every target
+    has been settled, and breaks ties between equal distances in the order the vertices were
+    pushed.
+
+    The graph is given as memoryviews of its (indptr, indices, weights) arrays, or is the one
+    opened by _attach if this is a worker process. Indexing a memoryview gives a Python number
+    without copying the array, so the search is as fast as on lists.
+    """
+    indptr, indices, weights = graph if graph is not None else _graph
+
+    distances = {source: 0}
+    predecessor = {source: None}
+    settled = set()
+    remaining = set(targets) - {source}
+
+    counter = itertools.count()
+    heap = [(0, next(counter), source)]
+
+    while heap and remaining:
+        dist, _, vertex = heapq.heappop(heap)
+        if vertex in settled:
+            continue
+        settled.add(vertex)
+
+        remaining.discard(vertex)
+        if not remaining:
+            break
+
+        for k in range(indptr[vertex], indptr[vertex + 1]):
+            neighbour = indices[k]
+            new_dist = dist + weights[k]
+            if neighbour not in settled and new_dist < distances.get(neighbour, float('inf')):
+                distances[neighbour] = new_dist
+                predecessor[neighbour] = vertex
+                heapq.heappush(heap, (new_dist, next(counter), neighbour))
+
+    paths = {}
+    for target in targets:
+        path = []
+        if predecessor.get(target) is not None:
+            curr = target
+            while curr is not None:
+                path.append(curr)
+                curr = predecessor[curr]
+            path.reverse()
+        paths[target] = path
+    return paths
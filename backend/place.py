@@ -11,17 +11,15 @@ Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
 
 from __future__ import annotations
 
-from visual.drawing import *
 
-
-class _Place(Drawable):
+class _Place:
     """A vertex in the City graph, used to represent a place in the city.
 
     Instance Attributes:
         - pos: The coordinates of the CENTRE of the place
         - neighbours: The vertices that are adjacent to this vertex and their respective distances
         - WIDTH: The width of this place in pixels, this place will be drawn as a square with
-                 side length WIDTH
+                 side length WIDTH (see visual/drawing.py)
 
     Representation Invariants:
         - self not in self.neighbours
@@ -45,13 +43,6 @@ class _Place(Drawable):
         x, y = self.pos
         return "place " + str(x) + " " + str(y)
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        rect = pygame.Rect(x - self.WIDTH // 2, y - self.WIDTH // 2, self.WIDTH, self.WIDTH)
-        pygame.draw.rect(screen, PLACE, rect)
-
     def pos_on_place(self, m_pos: tuple[int, int]) -> bool:
         """
         Return whether the given mouse position <m_pos> is on this place on the canvas.
@@ -88,12 +79,6 @@ class _Intersection(_Place):
         x, y = self.pos
         return "intersection " + str(x) + " " + str(y)
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        pygame.draw.circle(screen, STREET, (x, y), self.STREET_WIDTH)
-
 
 class _BusStop(_Place):
     """A vertex in the City graph, used to represent a bus stop in the city.
@@ -117,13 +102,6 @@ class _BusStop(_Place):
         x, y = self.pos
         return "bus_stop " + str(x) + " " + str(y)
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Draws this vertex within the pygame window
-        """
-        x, y = self.pos
-        rect = pygame.Rect(x - self.WIDTH // 2, y - self.WIDTH // 2, self.WIDTH, self.WIDTH)
-        pygame.draw.rect(screen, BUS_STOP, rect)
-
     def pos_on_bus_stop(self, m_pos: tuple[int, int]) -> bool:
         """Return whether the given mouse position <m_pos> is on this bus stop on the canvas.
         """
@@ -6,13 +6,21 @@ This file contains the class definitions for the objects needed to represent
 a city.
   - ComplicatedPlace
   - PlacePair
+  - DemandTable
   - ModelCity
+  - _LiveRoutes
 ================================================================================
 Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
 """
-import random
+from typing import Iterator, Optional
+
+import bisect
+import itertools
+
+import numpy as np
 
 from backend.city import *
+from backend.path_engine import PathEngine
 from backend.place import _Place, _BusStop
 from utils.utility_functions import *
 
@@ -35,8 +43,8 @@ class ComplicatedPlace(_Place):
     population_density: int  # per km squared
 
     def __init__(self, place: _Place) -> None:
-        super().__init__(copy.deepcopy(place.pos))
-        self.neighbours = copy.deepcopy(place.neighbours)
+        super().__init__(place.pos)
+        self.neighbours = dict(place.neighbours)
         self.population_density = 0
 
     def set_density(self, density: int) -> None:
@@ -55,6 +63,7 @@ class PlacePair:
         - path1flow: avg passenger # that want to travel from coords[0] to coords[1] in 1 hour
         - path2flow: avg passenger # that want to travel from coords[1] to coords[0] in 1 hour
     """
+    __slots__ = ('coords', 'path1flow', 'path2flow')
     coords: tuple[tuple[float, float], tuple[float, float]]
     path1flow: int
     path2flow: int
@@ -79,6 +88,94 @@ def avg_flow(pair: PlacePair) -> int:
     return int((pair.path1flow + pair.path2flow) / 2)
 
 
+class DemandTable:
+    """
+    The flows between every pair of places in a city, stored as arrays instead of one
+    PlacePair per pair. A PlacePair is only made for a pair when it is asked for.
+
+    Pair k is the pair (places[i], places[j]) with i < j that comes k-th when the pairs are
+    ordered by i and then by j (the order of numpy.triu_indices).
+
+    Instance Attributes:
+        - places: the positions of the places
+        - flows: an array with a row (path1flow, path2flow) for every pair
+
+    Private Instance Attributes:
+        - _row_starts: the index of the first pair (i, i + 1) of every place i
+
+    Representation Invariants:
+        - len(self.flows) == len(self.places) * (len(self.places) - 1) // 2
+    """
+    places: list[tuple]
+    flows: np.ndarray
+    _row_starts: np.ndarray
+
+    def __init__(self, places: list[tuple], flows: np.ndarray) -> None:
+        self.places = places
+        self.flows = flows
+
+        n = len(places)
+        rows = np.arange(n, dtype=np.int64)
+        self._row_starts = rows * (2 * n - rows - 1) // 2
+
+    def __len__(self) -> int:
+        return len(self.flows)
+
+    def __getitem__(self, k: int) -> PlacePair:
+        i, j = self.pair_indices(np.array([k]))
+        pair = PlacePair((self.places[int(i[0])], self.places[int(j[0])]))
+        pair.set_flow(int(self.flows[k, 0]), int(self.flows[k, 1]))
+        return pair
+
+    def pair_indices(self, ks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the indices (i, j) into self.places of the places in each of the pairs ks
+        """
+        i = np.searchsorted(self._row_starts, ks, side='right') - 1
+        return i, ks - self._row_starts[i] + i + 1
+
+    def average_flows(self) -> np.ndarray:
+        """
+        Return the average flow of every pair, as avg_flow does for a PlacePair
+        """
+        return ((self.flows[:, 0] + self.flows[:, 1]) / 2).astype(np.int64)
+
+    def by_descending_flow(self, block_size: int = 1024) -> Iterator[PlacePair]:
+        """
+        Yield every pair from the highest average flow to the lowest, keeping pairs with the
+        same average flow in order (like a stable sort).
+
+        Only the pairs that are asked for are sorted: each step uses numpy.argpartition to
+        pick out the next block_size pairs (and anything tied with the last of them), sorts
+        just those, and doubles the block size for the next step.
+
+        Preconditions:
+            - block_size > 0
+        """
+        average = self.average_flows()
+        remaining = np.arange(len(average))
+
+        while len(remaining) != 0:
+            keys = -average[remaining]
+            if len(remaining) > block_size:
+                threshold = keys[np.argpartition(keys, block_size - 1)[block_size - 1]]
+                in_block = keys <= threshold
+            else:
+                in_block = np.ones(len(remaining), dtype=bool)
+
+            # remaining is in increasing order, so a stable sort keeps tied pairs in order
+            block = remaining[in_block]
+            block = block[np.argsort(keys[in_block], kind='stable')]
+            remaining = remaining[~in_block]
+            block_size *= 2
+
+            first, second = self.pair_indices(block)
+            for k, i, j in zip(block.tolist(), first.tolist(), second.tolist()):
+                pair = PlacePair((self.places[i], self.places[j]))
+                pair.set_flow(int(self.flows[k, 0]), int(self.flows[k, 1]))
+                yield pair
+
+
 class ModelCity(City):
     """
     A slightly modified city class for route generation modeling.
@@ -91,23 +188,35 @@ class ModelCity(City):
         - _bus_stops: a dictionary of coordinate to bus stop pairs
         - _bus_routes: a list of lists of tuples; every list of tuple in this list
                         represents a bus route, with each tuple representing a coordinate.
-        - _place_pairs: a list of PlacePair s.
+        - _demand: the flows between every pair of places (see generate_city)
         - _simple_city: the City() class this CityModel is based on.
     """
     _places: dict[tuple, ComplicatedPlace]
     _streets: set[tuple[tuple, tuple]]
     _bus_stops: dict[tuple: _BusStop]
     _bus_routes: list[list[tuple]]
-    _place_pairs: list[PlacePair]
+    _demand: DemandTable
     _simple_city: City
 
     def __init__(self, city: City) -> None:
         super().__init__()
         self._places = {index: ComplicatedPlace(city._places[index]) for index in city._places}
         self._streets = copy.deepcopy(city._streets)
-        self._bus_stops = copy.deepcopy(city._bus_stops[0])
+        self._bus_stops = {pos: _BusStop(pos) for pos in city._bus_stops[0]}
+
+        # Connect the copies to each other, instead of deep copying the whole graph once for
+        # every place (which also hits the recursion limit on large cities)
+        copies = {}
+        for pos, vertex in city._places.items():
+            copies[id(vertex)] = self._places[pos]
+        for pos, vertex in city._bus_stops[0].items():
+            copies[id(vertex)] = self._bus_stops[pos]
+            self._bus_stops[pos].neighbours = dict(vertex.neighbours)
+        for vertex in itertools.chain(self._places.values(), self._bus_stops.values()):
+            vertex.neighbours = {copies[id(neighbour)]: weight
+                                 for neighbour, weight in vertex.neighbours.items()}
         self._bus_routes = copy.deepcopy(city._bus_routes)
-        self._place_pairs = []
+        self._demand = DemandTable([], np.empty((0, 2), dtype=np.int64))
         self._simple_city = city
 
     def return_bus_routes(self) -> list:
@@ -116,9 +225,17 @@ class ModelCity(City):
         """
         return self._bus_routes
 
-    def generate_city(self, city_type: str) -> None:
+    def place_weights(self) -> dict[tuple, int]:
         """
-        Generate a city of city_type for testing
+        Return a dictionary mapping the position of every place to its population density,
+        to weight the places by when clustering bus stops (see City._get_bus_stops)
+        """
+        return {pos: self._places[pos].population_density for pos in self._places}
+
+    def generate_city(self, city_type: str, random_state: Optional[int] = None) -> None:
+        """
+        Generate a city of city_type for testing, using random_state to seed the random number
+        generator
 
         city_type == "centered":
         Made sure several places in this city has a high population density (city centers)
@@ -132,52 +249,39 @@ class ModelCity(City):
         2. flow to dense areas should be partly proportional to the population of the high density
         area (city centers and high density places attracts more people).
 
+        The flows are generated for every pair of places at once and stored in a DemandTable,
+        so generating them is vectorized.
 
         precondition
             - len(self._places) > 1
+            - city_type in {"centered", "distributed"}
         """
-        places = [self._places[index] for index in self._places]
+        rng = np.random.default_rng(random_state)
+        positions = list(self._places)
+        n = len(positions)
+
         if city_type == "centered":
-            center_num = len(self._places) // 10
-            if center_num == 0:
-                center_num = 1
-            center_coords = []
-            for _ in range(center_num):
-                city_center = random.choice([self._places[index] for index in self._places])
-                city_center.population_density = random.randint(6000, 7000)
-                center_coords.append(city_center.pos)
-
-            for place in places:
-                if place.pos not in center_coords:
-                    place.population_density = random.randint(1000, 2000)
-
-        elif city_type == "distributed":
-            start_density = random.randint(100, 10000)
-            for place in places:
-                place.population_density = start_density * random.uniform(0.8, 1.2)
-
-        place_pairs = []
-        for place1 in places:
-            for place2 in places:
-                if (place2.pos, place1.pos) not in place_pairs\
-                        and place1.pos != place2.pos:
-                    place_pairs.append((place1.pos, place2.pos))
-                    place_pair = PlacePair((place1.pos, place2.pos))
-
-                    if place1.population_density < place2.population_density:
-
-                        place_pair.set_flow(int(place2.population_density
-                                                * random.uniform(0.5, 0.55)),
-                                            int(place2.population_density
-                                                * random.uniform(0.5, 0.55)))
-                    else:
-                        place_pair.set_flow(int(place1.population_density
-                                                * random.uniform(0.5, 0.55)),
-                                            int(place1.population_density
-                                                * random.uniform(0.5, 0.55)))
-                    self._place_pairs.append(place_pair)
-
-    def bus_route_model(self) -> None:
+            center_num = max(n // 10, 1)
+            densities = rng.integers(1000, 2000, size=n, endpoint=True)
+            # The city centers are picked with replacement, so a place can be picked twice
+            centers = rng.integers(0, n, size=center_num)
+            densities[centers] = rng.integers(6000, 7000, size=center_num, endpoint=True)
+        else:
+            start_density = int(rng.integers(100, 10000, endpoint=True))
+            densities = start_density * rng.uniform(0.8, 1.2, size=n)
+
+        for pos, density in zip(positions, densities.tolist()):
+            self._places[pos].population_density = density
+
+        # Pair k is (positions[first[k]], positions[second[k]]), with the pairs ordered by
+        # their first place and then by their second
+        first, second = np.triu_indices(n, 1)
+        densest = np.maximum(densities[first], densities[second])
+        flows = np.stack([densest * rng.uniform(0.5, 0.55, size=len(first)),
+                          densest * rng.uniform(0.5, 0.55, size=len(first))], axis=1)
+        self._demand = DemandTable(positions, flows.astype(np.int64))
+
+    def bus_route_model(self, processes: Optional[int] = 1, batch_size: int = 256) -> None:
         """
         The strategy is to pickout candidate bus routes that values high demand of consumers
         (prioritizes path flow) and merge those bus routes together, with the merge leaving
@@ -185,47 +289,71 @@ class ModelCity(City):
 
         For the specific computation plan please look at our project report.
 
+        The candidate paths are found batch_size place pairs at a time by a PathEngine with
+        <processes> worker processes (os.cpu_count() of them if processes is None). By default
+        they are found in this process, so no process pool or shared memory is set up. The
+        routes are the same for any number of processes.
+
+        Preconditions:
+            - processes is None or processes >= 1
+            - batch_size > 0
         """
         if self._bus_stops == dict():
             return
         self._bus_routes = []
-        self._place_pairs.sort(key=avg_flow, reverse=True)
+        all_bus_stops = list(self._bus_stops)
         bus_stops = list(self._bus_stops)
-        potential_paths = []
-        for pair in self._place_pairs:
-            distance1 = []
-            for coord in bus_stops:
-                distance1.append(distance(coord, pair.coords[0]))
-            b1 = bus_stops[distance1.index(min(distance1))]
 
-            distance2 = []
-            for coord in bus_stops:
-                distance2.append(distance(coord, pair.coords[1]))
-            b2 = bus_stops[distance2.index(min(distance2))]
-
-            path = self._simple_city.dijkstra_path(b1, b2)
-            potential_paths.append(path[0])
+        # Find the closest bus stop to every place once, comparing every place to every bus
+        # stop at the same time (a KD-tree is not used, so ties go to the first bus stop)
+        places = self._demand.places
+        _, closest = nearest_centers(places, all_bus_stops,
+                                     kd_tree_threshold=len(all_bus_stops) + 1,
+                                     chunk_size=max(1, 2 ** 20 // len(all_bus_stops)))
+        closest_stop = {pos: all_bus_stops[i] for pos, i in zip(places, closest.tolist())}
 
+        # Go through the pairs from the highest average flow to the lowest, only until every
+        # bus stop is on a route
         routes = []
-        for p in potential_paths:
-            for coordinate in p:
-                if coordinate in bus_stops:
-                    bus_stops.remove(coordinate)
-            if p != []:
-                routes.append(p)
-            if bus_stops == []:
-                break
-
-        routes2 = copy.copy(routes)
-
-        for r in routes:
-            for r2 in routes:
-                if r != r2 and r in routes2 and r2 in routes2:
+        paths = {}  # (b1, b2) -> the shortest path from b1 to b2, as a tuple
+        pairs = self._demand.by_descending_flow()
+        with PathEngine(self._simple_city.to_csr(), processes) as engine:
+            while bus_stops != []:
+                batch = [(closest_stop[pair.coords[0]], closest_stop[pair.coords[1]])
+                         for pair in itertools.islice(pairs, batch_size)]
+                if batch == []:
+                    break
+
+                queries = list(dict.fromkeys(q for q in batch if q not in paths))
+                paths.update(zip(queries, map(tuple, engine.shortest_paths(queries))))
+
+                for stop_pair in batch:
+                    # Place pairs with the same bus stops share a path, so every pair gets its
+                    # own list, since merge_route changes the routes it is given
+                    p = list(paths[stop_pair])
+                    for coordinate in p:
+                        if coordinate in bus_stops:
+                            bus_stops.remove(coordinate)
+                    if p != []:
+                        routes.append(p)
+                    if bus_stops == []:
+                        break
+
+        routes2 = _LiveRoutes(routes)
+
+        for i, r in enumerate(routes):
+            # Only a merge with r can make r live again, and that needs r to be live
+            if i not in routes2:
+                continue
+            for j, r2 in enumerate(routes):
+                if r != r2 and i in routes2 and j in routes2 and routes2.overlap(i, j):
                     merged_route = self.merge_route(r, r2)
+                    routes2.refresh(i)
+                    routes2.refresh(j)
                     if merged_route != []:
                         self._bus_routes.append(merged_route)
-                        routes2.remove(r)
-                        routes2.remove(r2)
+                        routes2.remove(i)
+                        routes2.remove(j)
 
         for r in routes2:
             self._bus_routes.append(r)
@@ -242,14 +370,12 @@ class ModelCity(City):
         >>> city.merge_route(
         ...     [(691, 477), (609, 273), (544, 250), (437, 256), (381, 195), (246, 226)],
         ...     [(381, 195), (246, 226)])
+        [(691, 477), (609, 273), (544, 250), (437, 256), (381, 195), (246, 226)]
         """
-        lst1_overlap = []
-        for element in lst1:
-            lst1_overlap.append(element in lst2)
-
-        lst2_overlap = []
-        for element in lst2:
-            lst2_overlap.append(element in lst1)
+        stops1 = set(lst1)
+        stops2 = set(lst2)
+        lst1_overlap = [element in stops2 for element in lst1]
+        lst2_overlap = [element in stops1 for element in lst2]
 
         consecutive_counter = 0
         for i in range(len(lst1_overlap)):
@@ -298,12 +424,83 @@ class ModelCity(City):
                 else:
                     return lst1
             elif lst1[0] == lst2[-1] and lst1[1] == lst2[-2]:
-                for _ in range(sum(lst1_overlap)):
-                    lst1.pop(0)
+                del lst1[:sum(lst1_overlap)]
                 return lst2 + lst1
             elif lst1[-1] == lst2[0] and lst1[-2] == lst2[1]:
-                for _ in range(sum(lst2_overlap)):
-                    lst2.pop(0)
+                del lst2[:sum(lst2_overlap)]
                 return lst1 + lst2
             else:
                 return []
+
+
+class _LiveRoutes:
+    """
+    The routes in bus_route_model that have not been merged yet, indexed by their stops.
+
+    This stands in for a list that starts as a copy of the routes and has routes removed from
+    it. A list checks whether a route is in it, and removes a route, by comparing it to every
+    route in the list; here both are a dictionary lookup. The results are the same as the
+    list's, including when two routes have the same stops, or when merge_route changes a
+    route: a route is live if any live route has the same stops, and removing it removes the
+    first live route (in the order of the routes) with the same stops.
+
+    Private Instance Attributes:
+        - _routes: all of the routes, live or not
+        - _keys: the stops of every route (as a tuple), as they were when it was last looked at
+        - _stops: the stops of every route as a set, as they were when it was last looked at
+        - _live: a dictionary mapping stops to the indices of the live routes with those stops,
+                 in increasing order
+        - _alive: the indices of the live routes
+    """
+    _routes: list[list[tuple]]
+    _keys: list[tuple]
+    _stops: list[set]
+    _live: dict[tuple, list[int]]
+    _alive: set[int]
+
+    def __init__(self, routes: list[list[tuple]]) -> None:
+        self._routes = routes
+        self._keys = [tuple(route) for route in routes]
+        self._stops = [set(route) for route in routes]
+        self._live = {}
+        for i, key in enumerate(self._keys):
+            self._live.setdefault(key, []).append(i)
+        self._alive = set(range(len(routes)))
+
+    def __contains__(self, i: int) -> bool:
+        """Return whether a live route has the same stops as route i
+        """
+        return bool(self._live.get(self._keys[i]))
+
+    def __iter__(self) -> Iterator[list[tuple]]:
+        """Iterate over the live routes, in order
+        """
+        return (self._routes[i] for i in sorted(self._alive))
+
+    def refresh(self, i: int) -> None:
+        """Update the index after route i may have been changed
+        """
+        key = tuple(self._routes[i])
+        if key != self._keys[i]:
+            if i in self._alive:
+                self._live[self._keys[i]].remove(i)
+                bisect.insort(self._live.setdefault(key, []), i)
+            self._keys[i] = key
+            self._stops[i] = set(key)
+
+    def overlap(self, i: int, j: int) -> bool:
+        """Return whether routes i and j have a stop in common, or either is empty.
+        merge_route returns [] without changing the routes in any other case, so it only has to
+        be called when this is True.
+        """
+        stops1, stops2 = self._stops[i], self._stops[j]
+        return not stops1 or not stops2 or not stops1.isdisjoint(stops2)
+
+    def remove(self, i: int) -> None:
+        """Remove the first live route with the same stops as route i. Raise a ValueError if
+        there is none (as list.remove does).
+        """
+        live = self._live.get(self._keys[i])
+        if not live:
+            raise ValueError
+        self._alive.remove(live.pop(0))
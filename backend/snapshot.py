@@ -0,0 +1,352 @@
+""" CSC111 Final Project: Bus Stop Creator
+snapshot.py
+
+================================================================================
+This file contains a read-only copy of the parts of a city that are needed to
+score a bus stop layout, so that layouts can be scored without changing the
+city, and in other processes.
+  - CitySnapshot
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+
+snapshot = city.snapshot()
+inertia, centers = score_bus_stops(snapshot, 4)
+"""
+from __future__ import annotations
+from typing import Iterator, Optional
+
+import numpy as np
+
+from utils.utility_functions import nearest_centers, nearest_projection
+
+
+class CitySnapshot:
+    """The places and streets of a city, stored as numpy arrays.
+
+    Instance Attributes:
+        - place_coords: An array of shape (n, 2) with the coordinates of every place
+        - street_starts: An array of shape (m, 2) with the first endpoint of every street
+        - street_ends: An array of shape (m, 2) with the second endpoint of every street
+        - street_between_places: An array of m booleans, True when both endpoints of the street
+                                 are places (so a bus stop can be put in the middle of it)
+        - place_weights: An array of n weights (such as population densities) for the places,
+                         or None if every place counts the same
+
+    Representation Invariants:
+        - len(self.street_starts) == len(self.street_ends) == len(self.street_between_places)
+        - self.place_weights is None or len(self.place_weights) == len(self.place_coords)
+    """
+    place_coords: np.ndarray
+    street_starts: np.ndarray
+    street_ends: np.ndarray
+    street_between_places: np.ndarray
+    place_weights: Optional[np.ndarray]
+
+    def __init__(self, place_coords: np.ndarray, street_starts: np.ndarray,
+                 street_ends: np.ndarray, street_between_places: np.ndarray,
+                 place_weights: Optional[np.ndarray] = None) -> None:
+        self.place_coords = place_coords
+        self.street_starts = street_starts
+        self.street_ends = street_ends
+        self.street_between_places = street_between_places
+        self.place_weights = place_weights
+
+
+def cluster_places(place_coords: np.ndarray, n_clusters: int,
+                   random_state: Optional[int] = None, mode: str = 'full',
+                   chunk_size: int = 10000, weights: Optional[np.ndarray] = None,
+                   cell_size: float = 20) -> list[tuple]:
+    """Return the centers of the n_clusters clusters of the given places found by the KMeans
+    clustering algorithm. If weights is given, every place counts weights[i] times, in every
+    mode.
+
+    mode == 'full':
+    Fit KMeans on every place at once.
+
+    mode == 'minibatch':
+    Stream the places, as a contiguous float32 array, through mini-batch k-means chunk_size
+    places at a time (see minibatch_kmeans), which is much faster and lighter on memory for
+    very large numbers of places. The centers are moved towards the weighted means of the
+    chunks.
+
+    mode == 'binned':
+    Group the places into square grid cells of side cell_size (see bin_places) and fit
+    weighted KMeans on the cell centroids, so that far fewer samples are clustered. Each cell
+    is weighted by the summed weights of its places (or by how many places it has, if weights
+    is None), which pulls the centers towards where the people are.
+
+    Preconditions:
+        - mode in {'full', 'minibatch', 'binned'}
+        - 1 <= n_clusters <= len(place_coords)
+        - weights is None or len(weights) == len(place_coords)
+    """
+    # sklearn takes seconds to import, so it is only imported once clustering is needed
+    from sklearn.cluster import KMeans
+
+    if mode == 'minibatch':
+        coords = np.ascontiguousarray(place_coords, dtype=np.float32)
+        centers = minibatch_kmeans(coords, n_clusters, chunk_size, random_state,
+                                   weights=weights)
+        return [(float(x), float(y)) for x, y in centers]
+
+    sample_weight = weights
+    if mode == 'binned':
+        centroids, cell_weights = bin_places(place_coords, weights, cell_size)
+        # Every cluster needs at least one sample, so fall back on the places themselves
+        if len(centroids) >= n_clusters:
+            place_coords, sample_weight = centroids, cell_weights
+
+    km = KMeans(n_clusters=n_clusters, init='k-means++', random_state=random_state)
+    km.fit(place_coords, sample_weight=sample_weight)
+    return [(float(x), float(y)) for x, y in km.cluster_centers_]
+
+
+def bin_places(place_coords: np.ndarray, weights: Optional[np.ndarray],
+               cell_size: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return a tuple of (centroids, cell_weights) for every square grid cell of side cell_size
+    that has at least one of the given places in it: the mean position of the places in the
+    cell, and the sum of their weights (or the number of places, if weights is None).
+
+    Preconditions:
+        - cell_size > 0
+        - weights is None or len(weights) == len(place_coords)
+    """
+    place_coords = np.asarray(place_coords, dtype=np.float64).reshape(-1, 2)
+    if weights is None:
+        weights = np.ones(len(place_coords), dtype=np.float64)
+
+    cells = np.floor(place_coords / cell_size).astype(np.int64)
+    _, cell_of_place = np.unique(cells, axis=0, return_inverse=True)
+    cell_of_place = cell_of_place.reshape(-1)
+    n_cells = int(cell_of_place.max()) + 1 if len(cell_of_place) > 0 else 0
+
+    counts = np.bincount(cell_of_place, minlength=n_cells)
+    centroids = np.column_stack([
+        np.bincount(cell_of_place, weights=place_coords[:, 0], minlength=n_cells) / counts,
+        np.bincount(cell_of_place, weights=place_coords[:, 1], minlength=n_cells) / counts])
+    cell_weights = np.bincount(cell_of_place, weights=weights, minlength=n_cells)
+
+    return centroids, cell_weights
+
+
+def minibatch_kmeans(coords: np.ndarray, n_clusters: int, chunk_size: int,
+                     random_state: Optional[int] = None, passes: int = 1,
+                     weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Return the centers of n_clusters clusters of the given points, found by mini-batch k-means.
+
+    The initial centers are picked with k-means++ from a random sample of the points. Then, for
+    every pass, the points are visited in a random order chunk_size at a time, and every center
+    is moved towards the mean of the points in the chunk closest to it. The further a center
+    has moved already, the smaller each step is.
+
+    If weights is given, every point counts weights[i] times, both when the initial centers
+    are picked and when they are moved, so a center moves towards the weighted mean of its
+    points, and its steps shrink with the total weight it has seen.
+
+    Only one chunk of points is ever copied, so coords can be a memory-mapped array.
+
+    Preconditions:
+        - 1 <= n_clusters <= len(coords)
+        - chunk_size > 0
+        - weights is None or (len(weights) == len(coords) and all(w >= 0 for w in weights))
+    """
+    from sklearn.cluster import kmeans_plusplus
+
+    rng = np.random.default_rng(random_state)
+    n = len(coords)
+
+    sampled = np.sort(rng.choice(n, size=min(n, max(10 * n_clusters, chunk_size)),
+                                 replace=False))
+    if weights is None:
+        centers, _ = kmeans_plusplus(coords[sampled].astype(np.float64), n_clusters,
+                                     random_state=random_state)
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        centers, _ = kmeans_plusplus(coords[sampled].astype(np.float64), n_clusters,
+                                     sample_weight=weights[sampled], random_state=random_state)
+    counts = np.zeros(n_clusters, dtype=np.float64)
+
+    for _ in range(passes):
+        order = rng.permutation(n)
+        for lo in range(0, n, chunk_size):
+            in_chunk = np.sort(order[lo:lo + chunk_size])
+            chunk = coords[in_chunk]
+            _, labels = nearest_centers(chunk, centers)
+
+            if weights is None:
+                chunk_counts = np.bincount(labels, minlength=n_clusters)
+                chunk_sums = np.column_stack([
+                    np.bincount(labels, weights=chunk[:, 0], minlength=n_clusters),
+                    np.bincount(labels, weights=chunk[:, 1], minlength=n_clusters)])
+            else:
+                chunk_weights = weights[in_chunk]
+                chunk_counts = np.bincount(labels, weights=chunk_weights, minlength=n_clusters)
+                chunk_sums = np.column_stack([
+                    np.bincount(labels, weights=chunk[:, 0] * chunk_weights,
+                                minlength=n_clusters),
+                    np.bincount(labels, weights=chunk[:, 1] * chunk_weights,
+                                minlength=n_clusters)])
+
+            counts += chunk_counts
+            moved = chunk_counts > 0
+            centers[moved] += (chunk_sums[moved] - chunk_counts[moved, np.newaxis]
+                               * centers[moved]) / counts[moved, np.newaxis]
+
+    return centers
+
+
+def incremental_clusterings(place_coords: np.ndarray, k_min: int, k_max: int,
+                            random_state: Optional[int] = None,
+                            split_iterations: int = 10) -> Iterator[tuple[int, list]]:
+    """
+    Yield (k, centers) for k = k_min, k_min + 1, ..., k_max, where centers are the centers of
+    k clusters of the given places.
+
+    Only the first clustering is a full KMeans fit (with k-means++). Every other one is made
+    from the one before it by a local step, so the whole sweep costs about as much as a few
+    full fits:
+      - the cluster with the largest sum of squared distances is split in two along the
+        direction its places are most spread out in, and the split is refined with up to
+        split_iterations rounds of 2-means on the places of that cluster only
+      - every place that is closer to one of the two new centers than to its own center moves
+        to it, and the centers of the clusters that changed are recomputed
+    The other centers are kept, so the clusterings are not as tight as independent fits, but
+    are close enough to find the elbow of the inertia curve.
+
+    Preconditions:
+        - 1 <= k_min <= k_max <= len(place_coords)
+        - split_iterations >= 1
+    """
+    from sklearn.cluster import KMeans
+
+    place_coords = np.ascontiguousarray(place_coords, dtype=np.float64)
+
+    km = KMeans(n_clusters=k_min, init='k-means++', random_state=random_state)
+    km.fit(place_coords)
+    centers = km.cluster_centers_
+    labels = km.labels_.astype(np.int64)
+    yield k_min, list(map(tuple, centers))
+
+    squared_distances = _squared_distances(place_coords, centers[labels])
+
+    for k in range(k_min + 1, k_max + 1):
+        # Find the cluster with the largest sum of squared distances to its center
+        worst = int(np.argmax(np.bincount(labels, weights=squared_distances,
+                                          minlength=len(centers))))
+        in_worst = np.flatnonzero(labels == worst)
+        members = place_coords[in_worst]
+
+        # Split it along its principal axis, one standard deviation either side of the center,
+        # and refine the two halves on its own places
+        offsets = members - centers[worst]
+        eigenvalues, eigenvectors = np.linalg.eigh(offsets.T @ offsets / len(members))
+        step = np.sqrt(eigenvalues[-1]) * eigenvectors[:, -1]
+        halves = np.vstack([centers[worst] - step, centers[worst] + step])
+        for _ in range(split_iterations):
+            side = _closest_of_two(members, halves)
+            new_halves = halves.copy()
+            for s in (0, 1):
+                if np.any(side == s):
+                    new_halves[s] = members[side == s].mean(axis=0)
+            if np.array_equal(new_halves, halves):
+                break
+            halves = new_halves
+
+        # The split cluster is replaced by the two halves at the end
+        centers = np.vstack([np.delete(centers, worst, axis=0), halves])
+        labels -= labels > worst
+        labels[in_worst] = k - 2 + _closest_of_two(members, halves)
+        squared_distances[in_worst] = _squared_distances(members, centers[labels[in_worst]])
+
+        # Let the places of the other clusters move to the two new centers if they are closer
+        to_first = _squared_distances(place_coords, halves[0])
+        to_second = _squared_distances(place_coords, halves[1])
+        closer = np.flatnonzero(np.minimum(to_first, to_second) < squared_distances)
+        if len(closer) != 0:
+            changed = np.union1d(labels[closer], [k - 2, k - 1])
+            labels[closer] = k - 2 + (to_second[closer] < to_first[closer])
+
+            # Recompute the centers of the clusters that lost or gained places
+            counts = np.bincount(labels, minlength=k)[changed]
+            sums = np.stack([np.bincount(labels, weights=place_coords[:, 0], minlength=k),
+                             np.bincount(labels, weights=place_coords[:, 1], minlength=k)],
+                            axis=1)[changed]
+            nonempty = counts > 0
+            centers[changed[nonempty]] = sums[nonempty] / counts[nonempty, np.newaxis]
+
+            in_changed = np.flatnonzero(np.isin(labels, changed))
+            squared_distances[in_changed] = _squared_distances(place_coords[in_changed],
+                                                               centers[labels[in_changed]])
+
+        yield k, list(map(tuple, centers))
+
+
+def _closest_of_two(points: np.ndarray, pair: np.ndarray) -> np.ndarray:
+    """Return 0 or 1 for every point, whichever of the two points in pair it is closest to
+    (0 if it is as close to both)
+    """
+    return (_squared_distances(points, pair[1]) < _squared_distances(points, pair[0])) \
+        .astype(np.int64)
+
+
+def _squared_distances(points: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Return the squared distance from every point in the (n, 2) array points to the matching
+    point in others, which is either another (n, 2) array or a single point
+    """
+    others = np.asarray(others)
+    dx = points[:, 0] - others[..., 0]
+    dy = points[:, 1] - others[..., 1]
+    return dx * dx + dy * dy
+
+
+def project_bus_stops(snapshot: CitySnapshot, centers: list[tuple]) -> list:
+    """
+    Return where each of the given centers would become a bus stop, in the same way as
+    City._bus_stop_projections but without changing the city: the projection onto the closest
+    street, rounded for pygame, or None if it cannot be put on that street.
+    """
+    if len(snapshot.street_starts) == 0:
+        return [None] * len(centers)
+
+    indices, projections, _ = nearest_projection(centers, snapshot.street_starts,
+                                                 snapshot.street_ends, chunk_size=1024)
+
+    projected = []
+    for i, proj in zip(indices, projections):
+        at_endpoint = np.array_equal(proj, snapshot.street_starts[i]) or \
+            np.array_equal(proj, snapshot.street_ends[i])
+        if at_endpoint or snapshot.street_between_places[i]:
+            projected.append((int(proj[0]), int(proj[1])))
+        else:
+            projected.append(None)
+    return projected
+
+
+def score_centers(snapshot: CitySnapshot, centers: list[tuple]) -> tuple[float, list[tuple]]:
+    """
+    Return a tuple of (inertia, centers), where inertia is what City.place_bus_stops(centers)
+    would return for the city in the snapshot.
+    """
+    projected = project_bus_stops(snapshot, centers)
+    if None in projected:
+        return -1.0, centers
+
+    squared_distances, _ = nearest_centers(snapshot.place_coords, projected)
+    return float(squared_distances.sum()), centers
+
+
+def score_bus_stops(snapshot: CitySnapshot, k: int, random_state: Optional[int] = None,
+                    mode: str = 'full', chunk_size: int = 10000,
+                    cell_size: float = 20) -> tuple[float, list[tuple]]:
+    """
+    Cluster the places in the snapshot into k clusters (see cluster_places), weighted by
+    snapshot.place_weights, and return a tuple of (inertia, centers) for the resulting bus stop
+    layout (see score_centers).
+
+    This is a module level function so that it can be run in a process pool.
+    """
+    centers = cluster_places(snapshot.place_coords, k, random_state, mode, chunk_size,
+                             snapshot.place_weights, cell_size)
+    return score_centers(snapshot, centers)
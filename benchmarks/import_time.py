@@ -0,0 +1,56 @@
+""" CSC111 Final Project: Bus Stop Creator
+import_time.py
+
+================================================================================
+Benchmark for how long it takes to import backend.city. Loading a map in a batch
+job should not pull in the GUI (pygame) or the machine learning stack (sklearn,
+scipy), so this fails if any of them are imported, or if the import takes longer
+than the budget.
+
+python -m benchmarks.import_time
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+"""
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pygame', 'sklearn', 'scipy', 'pandas']
+
+# Each run happens in a fresh interpreter, so that nothing is already imported
+IMPORT_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+import backend.city
+print(time.perf_counter() - t0)
+print(' '.join(name for name in {heavy} if name in sys.modules))
+"""
+
+
+def time_import(repeats: int = 5) -> tuple[float, list[str]]:
+    """Return a tuple of (the best time in seconds out of <repeats> imports of backend.city,
+    the heavy modules that were imported with it)
+    """
+    best = float('inf')
+    heavy = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout.split('\n')
+        best = min(best, float(output[0]))
+        heavy = output[1].split()
+    return best, heavy
+
+
+def run_benchmark(budget: float = 0.5) -> bool:
+    """Print how long importing backend.city takes, and return whether it took less than
+    <budget> seconds without importing any of HEAVY_MODULES
+    """
+    seconds, heavy = time_import()
+    print(f'import backend.city: {seconds:.3f}s (budget {budget:.3f}s)')
+    if heavy:
+        print(f'Heavy modules imported: {", ".join(heavy)}')
+
+    return seconds <= budget and not heavy
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run_benchmark() else 1)
@@ -0,0 +1,154 @@
+""" CSC111 Final Project: Bus Stop Creator
+pathfinding.py
+
+================================================================================
+Benchmark for the pathfinding algorithms in City. Grid shaped cities of growing
+size are built, and the time of a corner to corner query is compared to
+(V + E) log V. If the search runs in O((V + E) log V) time, the last column
+stays roughly constant as the city grows.
+
+A* with and without landmarks (ALT) is then compared with Dijkstra on random
+queries in a city with a sparse, irregular street network, where the straight
+line distance underestimates the distance by road and the landmarks prune
+much more of the search. How many places each search reaches is also printed.
+
+python -m benchmarks.pathfinding
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+"""
+import math
+import random
+import time
+
+from backend.city import City
+from utils.utility_functions import distance
+
+
+def build_grid_city(side: int, spacing: int = 10) -> City:
+    """Return a city whose places form a <side> x <side> grid, with a street between every
+    pair of horizontally or vertically adjacent places.
+    """
+    city = City()
+    for i in range(side):
+        for j in range(side):
+            city.add_place((i * spacing, j * spacing))
+
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                city.add_street((i * spacing, j * spacing), ((i + 1) * spacing, j * spacing))
+            if j + 1 < side:
+                city.add_street((i * spacing, j * spacing), (i * spacing, (j + 1) * spacing))
+
+    return city
+
+
+def build_sparse_city(side: int, spacing: int = 10, keep: float = 0.6,
+                      seed: int = 0) -> City:
+    """Return a city whose places are a <side> x <side> grid starting at (spacing, spacing),
+    each moved by up to 3 in either direction, where each street between adjacent places only exists with probability
+    <keep>. The streets wind around the missing ones, so the distance by road is often much
+    longer than the straight line.
+    """
+    rng = random.Random(seed)
+    city = City()
+    positions = {}
+    for i in range(side):
+        for j in range(side):
+            positions[(i, j)] = ((i + 1) * spacing + rng.randint(-3, 3),
+                                 (j + 1) * spacing + rng.randint(-3, 3))
+            city.add_place(positions[(i, j)])
+
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side and rng.random() < keep:
+                city.add_street(positions[(i, j)], positions[(i + 1, j)])
+            if j + 1 < side and rng.random() < keep:
+                city.add_street(positions[(i, j)], positions[(i, j + 1)])
+
+    return city
+
+
+def count_reached(city: City, start: tuple, end: tuple) -> int:
+    """Return how many times a_star_path(start, end) estimates the distance to end, which is
+    once for every time a place is reached
+    """
+    calls = [0]
+
+    def counting_distance(pos: tuple, target: tuple) -> float:
+        calls[0] += 1
+        return distance(pos, target)
+
+    city.a_star_path(start, end, counting_distance)
+    return calls[0]
+
+
+def time_query(query: callable, start: tuple, end: tuple, repeats: int = 3) -> float:
+    """Return the best time in seconds out of <repeats> runs of query(start, end)
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        query(start, end)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run_benchmark(sides: tuple = (25, 50, 100, 150, 225)) -> None:
+    """Print the query time of dijkstra_path on grid cities with the given side lengths
+    """
+    print(f'{"V":>8} {"E":>8} {"seconds":>10} {"ns / ((V + E) log V)":>22}')
+    for side in sides:
+        city = build_grid_city(side)
+        v = side * side
+        e = 2 * side * (side - 1)
+        seconds = time_query(city.dijkstra_path, (0, 0), ((side - 1) * 10, (side - 1) * 10))
+        scaled = seconds * 1e9 / ((v + e) * math.log2(v))
+        print(f'{v:>8} {e:>8} {seconds:>10.4f} {scaled:>22.2f}')
+
+
+def run_a_star_benchmark(side: int = 100, landmarks: int = 8, queries: int = 20,
+                         seed: int = 0) -> None:
+    """Print the total time of <queries> random long queries in a sparse city (see
+    build_sparse_city) using Dijkstra, A* and A* with landmarks, and the average number of
+    places reached by each A* search.
+
+    The queries are between places that can reach the place in the middle of the city, so
+    every query has a path, and that are at least half the width of the city apart, which is
+    where the landmarks help the most.
+    """
+    city = build_sparse_city(side, seed=seed)
+    middle = min(city.get_all_places(), key=lambda pos: distance(pos, (side * 5, side * 5)))
+    reachable = sorted(city.shortest_path_tree(middle)[0])
+
+    rng = random.Random(seed)
+    pairs = []
+    while len(pairs) < queries:
+        start, end = rng.choice(reachable), rng.choice(reachable)
+        if distance(start, end) >= side * 5:
+            pairs.append((start, end))
+
+    def time_all(query: callable) -> float:
+        t0 = time.perf_counter()
+        for start, end in pairs:
+            query(start, end)
+        return time.perf_counter() - t0
+
+    def average_reached() -> float:
+        return sum(count_reached(city, start, end) for start, end in pairs) / queries
+
+    print(f'{queries} long queries between {len(reachable)} connected places:')
+    print(f'Dijkstra: {time_all(city.dijkstra_path):.4f}s')
+    print(f'A*: {time_all(city.a_star_path):.4f}s, '
+          f'{average_reached():.0f} places reached per query')
+
+    t0 = time.perf_counter()
+    city.prepare_landmarks(landmarks)
+    print(f'Landmark preprocessing ({landmarks} landmarks): {time.perf_counter() - t0:.4f}s')
+    print(f'A* with landmarks: {time_all(city.a_star_path):.4f}s, '
+          f'{average_reached():.0f} places reached per query')
+
+
+if __name__ == '__main__':
+    run_benchmark()
+    run_a_star_benchmark()
@@ -10,8 +10,13 @@ Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
 city = City.build_from_file("data/map.txt", "data/bus.txt")
 city.shortest_path((437,256), (609,273))
 """
-# import pygame
+import random
+import time
+
+import pygame
+
 from backend.route import *
+from visual.drawing import *
 
 WIDTH, HEIGHT = 1000, 800
 
@@ -20,20 +25,35 @@ def run_visualization(map_file: str = "data/map.txt",
                       bus_file: str = "data/bus.txt",
                       map_save: str = "data/map_save.txt",
                       bus_save: str = "data/bus_save.txt",
-                      heuristic: callable = manhattan) -> None:
+                      heuristic: callable = distance,
+                      max_fps: int = 60,
+                      show_frame_time: bool = False,
+                      incremental: bool = False) -> None:
     """
     Run the interactive city builder. If <input_file> != "", import the city from the file.
 
     Refer to the project report for a full list of controls.
 
+    The builder sleeps until there is input, and then draws at most max_fps frames a second,
+    only updating the window when something on it changed. If show_frame_time is True, the
+    time taken to handle the input and draw the last frame is shown in the window's title.
+
+    If incremental is True, pressing b1 chooses the number of bus stops with clusterings that
+    are warm started from each other (see City.get_bus_stops_num).
+
     Preconditions:
       - input_file and output_file, if specified, are .txt files in the data folder
       - input_file must exist if specified
       - heuristic must be distance, manhattan or diagonal from utility_functions.py
+        (only distance is guaranteed to give the shortest path)
+      - max_fps > 0
     """
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    screen.fill(GRASS)  # Initially fill the screen with grass colour
+
+    # Moving the mouse does nothing, so it should not wake the builder up
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    clock = pygame.time.Clock()
 
     # Misc variables for running pygame and city
     running = True
@@ -47,9 +67,14 @@ def run_visualization(map_file: str = "data/map.txt",
     if map_file != "" and bus_file != "":
         city = City.build_from_file(map_file, bus_file)
 
-    city.draw(screen)  # Draw at the start
+    # Draws the city at the start, then only the parts of it that change
+    renderer = CityRenderer(city, (WIDTH, HEIGHT))
 
     while running:
+        # Sleep until there is input, then handle everything that has come in since
+        events = [pygame.event.wait()] + pygame.event.get()
+        frame_start = time.perf_counter()
+
         # Get whatever key is pressed
         key = pygame.key.get_pressed()
 
@@ -64,10 +89,15 @@ def run_visualization(map_file: str = "data/map.txt",
         path = []
 
         # Check for user mouse input
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
 
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED,
+                              pygame.WINDOWSIZECHANGED):
+                # The window manager may have thrown away what was on the window
+                renderer.invalidate()
+
             if event.type == pygame.MOUSEBUTTONDOWN:  # Check for mouse click
                 # Get the user's mouse coordinates
                 mouse_pos = pygame.mouse.get_pos()
@@ -151,46 +181,31 @@ def run_visualization(map_file: str = "data/map.txt",
                         city.add_place(mouse_pos)
 
                 # Only need to update the screen when something is added to the city
-                screen.fill(GRASS)
-                city.draw(screen)
+                renderer.sync()
+                overlays = []
                 if len(path) >= 2:
                     color = random.choice(COLOURS)
                     for i in range(len(path)):
                         if i != len(path) - 1:
-                            city.draw_highlighted_street((path[i], path[i + 1]), screen,
-                                                         color)
+                            overlays.append(((path[i], path[i + 1]), color))
                 # The advantage of doing this is that the bus stops disappear when you modify
                 # the city, and that makes sense
+                renderer.set_overlays(overlays)
 
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_1 and pygame.K_b:
                     # Press 'b1' to override existing bus stops and generate new ones
-                    k = city.get_bus_stops_num()
-
-                    # Generate new bus stops by mutating the current city repeatedly
-                    # (until we get the best inertia for the k means algorithm),
-                    # then display it. Check calculate_inertia() in city_classes.py
-                    # on what is inertia. The reason this is done is because a new
-                    # inertia exist after projection.
-                    counter = 1
-                    safety_counter = 1
-                    while True:
-                        if counter == 5:
-                            break
-                        temp_inertia = city.add_bus_stops(k)
-
-                        if math.isclose(temp_inertia, city.get_inertia()):
-                            counter += 1
-                        else:
-                            counter = 1
-                            city.change_inertia(temp_inertia)
+                    # Scored in this process, so no process pool is forked from the editor
+                    k = city.get_bus_stops_num(processes=1, incremental=incremental)
 
-                        safety_counter += 1
-                        if safety_counter == 100:
-                            break
+                    # Generate new bus stops by trying many clusterings and keeping the one
+                    # with the best inertia. Check calculate_inertia() in city.py on what
+                    # is inertia. The reason this is done is because a new inertia exist
+                    # after projection.
+                    city.optimize_bus_stops(k, processes=1, time_budget=2.0)
 
-                    screen.fill(GRASS)
-                    city.draw(screen)
+                    renderer.sync()
+                    renderer.set_overlays([])
                 if event.key == pygame.K_2 and pygame.K_b:
                     # get the bus routes!
                     complicated_city = ModelCity(city)
@@ -200,15 +215,15 @@ def run_visualization(map_file: str = "data/map.txt",
                     for r in bus_routes:
                         city.add_bus_route(r)
 
-                    screen.fill(GRASS)
-                    city.draw(screen)
+                    renderer.sync()
+                    overlays = []
                     for p in bus_routes:
                         if len(p) >= 2:
                             color = random.choice(COLOURS)
                             for i in range(len(p)):
                                 if i != len(p) - 1:
-                                    city.draw_highlighted_street((p[i], p[i + 1]), screen,
-                                                                 color)
+                                    overlays.append(((p[i], p[i + 1]), color))
+                    renderer.set_overlays(overlays)
 
                 if event.key == pygame.K_s and ctrl_down:  # Ctrl + s to save the city
                     city.export_to_file(map_save, bus_save)
@@ -216,7 +231,17 @@ def run_visualization(map_file: str = "data/map.txt",
                 if event.key == pygame.K_q:  # q to quit
                     running = False
 
-        pygame.display.flip()
+        # Only update the parts of the window that changed, if any did
+        dirty = renderer.render(screen)
+        if dirty:
+            pygame.display.update(dirty)
+
+            if show_frame_time:
+                frame_time = 1000 * (time.perf_counter() - frame_start)
+                pygame.display.set_caption(f'Bus Stop Creator ({frame_time:.1f} ms per frame)')
+
+            # Wait before the next frame, so that no more than max_fps are drawn a second
+            clock.tick(max_fps)
 
     pygame.display.quit()
 
@@ -0,0 +1,131 @@
+""" CSC111 Final Project: Bus Stop Creator
+pipeline.py
+
+================================================================================
+This runs the same steps as pressing b1 and b2 in main.py, without a display:
+load a city, choose how many bus stops it needs, place them, model the bus
+routes and save the result. How long each stage took is printed at the end.
+
+python pipeline.py --map data/map.txt --bus data/bus.txt \
+    --map-out data/map_save.txt --bus-out data/bus_save.txt
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+"""
+from __future__ import annotations
+from typing import Optional
+
+import argparse
+import time
+
+from backend.city import City
+from backend.route import ModelCity
+
+
+def run_pipeline(map_file: str = "data/map.txt",
+                 bus_file: str = "data/bus.txt",
+                 map_save: str = "data/map_save.txt",
+                 bus_save: str = "data/bus_save.txt",
+                 city_type: str = "centered",
+                 processes: Optional[int] = 1,
+                 restarts: int = 100,
+                 time_budget: Optional[float] = None,
+                 mode: str = 'full',
+                 incremental: bool = False,
+                 seed: Optional[int] = None) -> list[tuple[str, float]]:
+    """
+    Generate bus stops and bus routes for the city in map_file and bus_file, save them to
+    map_save and bus_save, and return a list of (stage, seconds) for every stage.
+
+    Clustering and routing run in <processes> worker processes (one per CPU if processes is
+    None, or in this process if processes == 1).
+
+    If incremental is True, the number of bus stops is chosen with clusterings that are warm
+    started from each other (see City.get_bus_stops_num).
+
+    Preconditions:
+      - map_file and bus_file exist and are in the format described in City.export_to_file
+      - city_type in {'centered', 'distributed'}
+      - mode in {'full', 'minibatch', 'binned'}
+      - processes is None or processes >= 1
+    """
+    timings = []
+
+    t0 = time.perf_counter()
+    city = City.build_from_stream(map_file, bus_file)
+    timings.append(('load', time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    k = city.get_bus_stops_num(processes=processes, random_state=seed, mode=mode,
+                               incremental=incremental)
+    timings.append((f'stop count (k = {k})', time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    city.optimize_bus_stops(k, restarts=restarts, processes=processes,
+                            time_budget=time_budget, random_state=seed, mode=mode)
+    timings.append(('stop placement', time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    complicated_city = ModelCity(city)
+    complicated_city.generate_city(city_type, random_state=seed)
+    complicated_city.bus_route_model(processes=processes)
+    city.clear_bus_routes()
+    for r in complicated_city.return_bus_routes():
+        city.add_bus_route(r)
+    timings.append(('route model', time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    city.export_to_file(map_save, bus_save)
+    timings.append(('export', time.perf_counter() - t0))
+
+    return timings
+
+
+def _positive_int(value: str) -> int:
+    """Return value as an int, for argparse, if it is a whole number of at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a whole number')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {number}')
+    return number
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    """Run the pipeline with the given command line arguments and print the stage timings
+    """
+    parser = argparse.ArgumentParser(description='Generate bus stops and bus routes for a '
+                                                 'city without a display.')
+    parser.add_argument('--map', default='data/map.txt', help='the city map to read')
+    parser.add_argument('--bus', default='data/bus.txt', help='the bus file to read')
+    parser.add_argument('--map-out', default='data/map_save.txt', help='where to save the map')
+    parser.add_argument('--bus-out', default='data/bus_save.txt',
+                        help='where to save the bus stops and routes')
+    parser.add_argument('--city-type', default='centered', choices=['centered', 'distributed'],
+                        help='how population densities are generated for route modelling')
+    parser.add_argument('--processes', type=_positive_int, default=1,
+                        help='worker processes for clustering and routing (default: 1, which '
+                             'runs them in this process)')
+    parser.add_argument('--restarts', type=int, default=100,
+                        help='the most clusterings to try when placing bus stops')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='the most seconds to spend trying clusterings')
+    parser.add_argument('--mode', default='full', choices=['full', 'minibatch', 'binned'],
+                        help='how places are clustered')
+    parser.add_argument('--incremental', action='store_true',
+                        help='choose the number of bus stops with warm started clusterings')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible runs')
+    parsed = parser.parse_args(args)
+
+    timings = run_pipeline(parsed.map, parsed.bus, parsed.map_out, parsed.bus_out,
+                           parsed.city_type, parsed.processes, parsed.restarts,
+                           parsed.time_budget, parsed.mode, parsed.incremental, parsed.seed)
+
+    for stage, seconds in timings:
+        print(f'{stage:<24} {seconds:8.3f}s')
+    print(f'{"total":<24} {sum(seconds for _, seconds in timings):8.3f}s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+""" CSC111 Final Project: Bus Stop Creator
+binary_format.py
+
+================================================================================
+This contains the functions to read and write a set of named numpy arrays as one
+binary file, laid out so that every array can be memory-mapped straight from the
+file with numpy.memmap instead of being parsed.
+
+The file starts with MAGIC, then the length of the header as a little-endian
+unsigned 64-bit integer, then the header: a JSON object of the form
+
+    {"arrays": {name: {"dtype": ..., "shape": [...], "offset": ...}, ...},
+     "metadata": {...}}
+
+Every array is stored in C order at its offset (counted from the start of the
+file), which is a multiple of ALIGNMENT.
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'BUSCITY1'
+ALIGNMENT = 64
+
+
+def write_arrays(path: str, arrays: dict[str, np.ndarray], metadata: dict) -> None:
+    """Write the given arrays, and the JSON-serializable metadata, to the file at path
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # The offsets depend on how long the header is, which depends on the offsets, so leave
+    # enough room for the header before the first array
+    entries = {name: {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0}
+               for name, array in arrays.items()}
+    header_room = len(json.dumps({'arrays': entries, 'metadata': metadata})) + 32 * len(arrays)
+
+    offset = _align(len(MAGIC) + 8 + header_room)
+    for name, array in arrays.items():
+        entries[name]['offset'] = offset
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({'arrays': entries, 'metadata': metadata}).encode('utf-8')
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(entries[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(offset)
+
+
+def read_arrays(path: str, mmap: bool = True) -> tuple[dict[str, np.ndarray], dict]:
+    """Return a tuple of (arrays, metadata) read from the file at path. If mmap is True, the
+    arrays are read-only numpy.memmap views of the file, so nothing is read until it is used.
+
+    Raise a ValueError if the file is not in this format.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a binary city file')
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+
+        if mmap and all(shape):
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=entry['offset'],
+                                     shape=shape)
+        elif all(shape):
+            count = int(np.prod(shape))
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count,
+                                       offset=entry['offset']).reshape(shape)
+        else:
+            # numpy.memmap cannot map an empty array
+            arrays[name] = np.empty(shape, dtype=dtype)
+
+    return arrays, header['metadata']
+
+
+def _align(offset: int) -> int:
+    """Return the smallest multiple of ALIGNMENT that is at least offset
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
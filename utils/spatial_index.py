@@ -0,0 +1,205 @@
+""" CSC111 Final Project: Bus Stop Creator
+spatial_index.py
+
+================================================================================
+This contains a uniform grid used to quickly find the elements of a city that
+are near a given point.
+  - GridIndex
+================================================================================
+Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
+"""
+from __future__ import annotations
+from typing import Any, Iterator, Optional
+
+import math
+
+
+class GridIndex:
+    """A uniform grid over the plane. Every element is stored with its bounding box, in every
+    grid cell that the box overlaps, so only the elements in the cell containing a point have
+    to be checked to find the boxes containing it.
+
+    Instance Attributes:
+        - cell_size: The side length of every grid cell
+
+    Private Instance Attributes:
+        - _cells: A dictionary mapping the (column, row) of every non-empty cell to the keys of
+                  the elements in it (a dictionary is used as an insertion ordered set)
+        - _boxes: A dictionary mapping the key of every element to its bounding box
+                  (min x, min y, max x, max y)
+        - _extent: The (min column, min row, max column, max row) of every cell that has held
+                   an element since the grid was last cleared, or None if there are none
+
+    Representation Invariants:
+        - self.cell_size > 0
+        - all(key in self._boxes for cell in self._cells.values() for key in cell)
+    """
+    cell_size: float
+    _cells: dict[tuple[int, int], dict[Any, None]]
+    _boxes: dict[Any, tuple[float, float, float, float]]
+    _extent: Optional[tuple[int, int, int, int]]
+
+    def __init__(self, cell_size: float = 50) -> None:
+        self.cell_size = cell_size
+        self._cells = dict()
+        self._boxes = dict()
+        self._extent = None
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._boxes
+
+    def __iter__(self) -> Iterator:
+        return iter(self._boxes)
+
+    def get_box(self, key: Any) -> tuple[float, float, float, float]:
+        """Return the bounding box of the element with the given key
+
+        Preconditions:
+            - key in self
+        """
+        return self._boxes[key]
+
+    def insert(self, key: Any, box: tuple[float, float, float, float]) -> None:
+        """Add an element with the given key and bounding box to the grid, replacing any
+        element already stored with that key
+        """
+        if key in self._boxes:
+            self.remove(key)
+
+        self._boxes[key] = box
+        for cell in self._cells_overlapping(box):
+            self._cells.setdefault(cell, dict())[key] = None
+
+        min_col, min_row = self._cell_of((box[0], box[1]))
+        max_col, max_row = self._cell_of((box[2], box[3]))
+        if self._extent is None:
+            self._extent = (min_col, min_row, max_col, max_row)
+        else:
+            self._extent = (min(self._extent[0], min_col), min(self._extent[1], min_row),
+                            max(self._extent[2], max_col), max(self._extent[3], max_row))
+
+    def remove(self, key: Any) -> None:
+        """Remove the element with the given key from the grid, if it is there
+        """
+        box = self._boxes.pop(key, None)
+        if box is None:
+            return
+
+        for cell in self._cells_overlapping(box):
+            keys = self._cells.get(cell)
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    self._cells.pop(cell)
+
+    def clear(self) -> None:
+        """Remove every element from the grid
+        """
+        self._cells.clear()
+        self._boxes.clear()
+        self._extent = None
+
+    def query_point(self, point: tuple[float, float]) -> list:
+        """Return the keys of the elements whose bounding box contains the given point, in the
+        order they were inserted
+        """
+        x, y = point
+        keys = self._cells.get(self._cell_of(point), dict())
+
+        found = []
+        for key in keys:
+            min_x, min_y, max_x, max_y = self._boxes[key]
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                found.append(key)
+        return found
+
+    def query_box(self, box: tuple[float, float, float, float]) -> list:
+        """Return the keys of the elements whose bounding box overlaps the given box
+        (min x, min y, max x, max y), without duplicates
+        """
+        found = dict()
+        for cell in self._cells_overlapping(box):
+            for key in self._cells.get(cell, dict()):
+                if key not in found:
+                    min_x, min_y, max_x, max_y = self._boxes[key]
+                    if min_x <= box[2] and box[0] <= max_x and min_y <= box[3] and \
+                            box[1] <= max_y:
+                        found[key] = None
+        return list(found)
+
+    def nearest(self, point: tuple[float, float], distances_to: callable) -> tuple[Any, float]:
+        """
+        Return a tuple of (key, distance) for the element closest to the given point, or
+        (None, inf) if the grid is empty. distances_to(keys) must return the distance from the
+        point to each of the elements with the given keys; it is called once per ring of cells
+        so that the distances can be computed together.
+
+        The cells are searched in square rings of growing size around the cell containing the
+        point. The closest point of an element that was not found in the first r rings is
+        more than r * cell_size away, so the search stops as soon as the closest element so far
+        is at most that far.
+
+        Preconditions:
+            - every element lies inside its bounding box
+        """
+        best_key, best_dist = None, float('inf')
+        if self._extent is None:
+            return best_key, best_dist
+
+        col, row = self._cell_of(point)
+        min_col, min_row, max_col, max_row = self._extent
+        last_ring = max(col - min_col, max_col - col, row - min_row, max_row - row)
+
+        seen = set()
+        ring = 0
+        while ring <= last_ring:
+            keys = []
+            for cell in self._ring(col, row, ring):
+                for key in self._cells.get(cell, ()):
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+
+            if keys:
+                for key, dist in zip(keys, distances_to(keys)):
+                    if dist < best_dist:
+                        best_key, best_dist = key, dist
+
+            if best_dist <= ring * self.cell_size:
+                break
+            ring += 1
+
+        return best_key, best_dist
+
+    @staticmethod
+    def _ring(col: int, row: int, ring: int) -> list:
+        """Return the cells that are exactly <ring> cells away from (col, row), either
+        horizontally or vertically
+        """
+        if ring == 0:
+            return [(col, row)]
+
+        cells = []
+        for c in range(col - ring, col + ring + 1):
+            cells.append((c, row - ring))
+            cells.append((c, row + ring))
+        for r in range(row - ring + 1, row + ring):
+            cells.append((col - ring, r))
+            cells.append((col + ring, r))
+        return cells
+
+    def _cell_of(self, point: tuple[float, float]) -> tuple[int, int]:
+        """Return the (column, row) of the cell containing the given point
+        """
+        return (math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size))
+
+    def _cells_overlapping(self, box: tuple[float, float, float, float]) -> list:
+        """Return the (column, row) of every cell that the given box overlaps
+        """
+        min_col, min_row = self._cell_of((box[0], box[1]))
+        max_col, max_row = self._cell_of((box[2], box[3]))
+        return [(col, row) for col in range(min_col, max_col + 1)
+                for row in range(min_row, max_row + 1)]
@@ -45,6 +45,112 @@ def projection(a: tuple, b: tuple, p: tuple) -> tuple[float, float]:
     return tuple(res)
 
 
+def batch_projection(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """Return a tuple of (projections, distances) for every point and every line segment, where
+    projections[i, j] is the projection of points[i] onto the segment from starts[j] to ends[j]
+    (computed the same way as projection) and distances[i, j] is the distance from points[i]
+    to it.
+
+    points has shape (n, 2), starts and ends have shape (m, 2), projections has shape
+    (n, m, 2) and distances has shape (n, m).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    starts = np.asarray(starts, dtype=np.float64).reshape(1, -1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(1, -1, 2)
+
+    ap = points - starts
+    ab = ends - starts
+
+    dot_ab = ab[..., 0] * ab[..., 0] + ab[..., 1] * ab[..., 1]
+    dot_ap = ap[..., 0] * ab[..., 0] + ap[..., 1] * ab[..., 1]
+
+    # A segment with both ends at the same point projects everything onto that point
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(dot_ab > 0, dot_ap / dot_ab, 1.0)
+    t = np.clip(t, 0, 1)
+
+    res = starts + t[..., np.newaxis] * ab
+    offset = res - points
+
+    return res, np.sqrt(offset[..., 0] ** 2 + offset[..., 1] ** 2)
+
+
+def nearest_projection(points: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                       chunk_size: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return a tuple of (indices, projections, distances) where indices[i] is the index of the
+    line segment closest to points[i], projections[i] is the projection of points[i] onto it
+    and distances[i] is the distance between them. Ties go to the segment with the smaller
+    index.
+
+    If chunk_size is given, at most chunk_size points are compared to all the segments at once,
+    so that only chunk_size * len(starts) projections are ever held in memory.
+
+    Preconditions:
+        - len(starts) == len(ends) > 0
+        - chunk_size is None or chunk_size > 0
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(points)
+    if chunk_size is None:
+        chunk_size = max(n, 1)
+
+    indices = np.empty(n, dtype=np.int64)
+    projections = np.empty((n, 2), dtype=np.float64)
+    distances = np.empty(n, dtype=np.float64)
+
+    for lo in range(0, n, chunk_size):
+        hi = min(lo + chunk_size, n)
+        chunk_projections, chunk_distances = batch_projection(points[lo:hi], starts, ends)
+
+        closest = np.argmin(chunk_distances, axis=1)
+        rows = np.arange(hi - lo)
+        indices[lo:hi] = closest
+        projections[lo:hi] = chunk_projections[rows, closest]
+        distances[lo:hi] = chunk_distances[rows, closest]
+
+    return indices, projections, distances
+
+
+def nearest_centers(points: np.ndarray, centers: np.ndarray, kd_tree_threshold: int = 64,
+                    chunk_size: int = 65536) -> tuple[np.ndarray, np.ndarray]:
+    """Return a tuple of (squared_distances, assignment) where assignment[i] is the index of
+    the center closest to points[i] and squared_distances[i] is the squared distance between
+    them.
+
+    With fewer than kd_tree_threshold centers, every point is compared to every center at once
+    (chunk_size points at a time). Otherwise the centers are put in a KD-tree and each point
+    only looks at the centers near it.
+
+    Preconditions:
+        - len(centers) > 0
+        - chunk_size > 0
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+
+    if len(centers) >= kd_tree_threshold:
+        # scipy is slow to import, so it is only imported once a KD-tree is needed
+        from scipy.spatial import cKDTree
+
+        distances, assignment = cKDTree(centers).query(points)
+        return distances ** 2, assignment.astype(np.int64)
+
+    squared_distances = np.empty(len(points), dtype=np.float64)
+    assignment = np.empty(len(points), dtype=np.int64)
+
+    for lo in range(0, len(points), chunk_size):
+        chunk = points[lo:lo + chunk_size]
+        offsets = chunk[:, np.newaxis, :] - centers[np.newaxis, :, :]
+        chunk_distances = offsets[..., 0] ** 2 + offsets[..., 1] ** 2
+
+        closest = np.argmin(chunk_distances, axis=1)
+        assignment[lo:lo + chunk_size] = closest
+        squared_distances[lo:lo + chunk_size] = chunk_distances[np.arange(len(chunk)), closest]
+
+    return squared_distances, assignment
+
+
 def distance(pos1: tuple[float, float], pos2: tuple[float, float]) -> float:
     """Return the Euclidean distance between two coordinates
     """
@@ -117,7 +223,7 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['math', 'numpy'],
+        'extra-imports': ['math', 'numpy', 'scipy.spatial'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['E1136']
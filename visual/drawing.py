@@ -2,13 +2,21 @@
 drawing.py
 
 ================================================================================
-This file contains the class definitions and constants that will make drawing the city easier.
-  - Drawable
+This file contains the functions and constants that will make drawing the city easier.
+The city classes in the backend do not know about pygame; everything that is drawn
+is drawn from here.
+  - CityRenderer
 ================================================================================
 Copyright (c) 2021 Andy Wang, Varun Pillai, Ling Ai, Daniel Liu
 """
+import math
+
 import pygame
 
+from backend.city import City
+from backend.place import _Place
+from utils.spatial_index import GridIndex
+
 GRASS = (123, 168, 50)
 STREET = (59, 59, 59)
 PLACE = (117, 0, 0)
@@ -17,10 +25,245 @@ HIGHLIGHTED_STREET = (153, 0, 76)
 COLOURS = [(153, 0, 76), (252, 186, 3), (3, 169, 252), (40, 3, 252),
            (252, 3, 45), (252, 3, 3), (3, 252, 140), (136, 3, 252)]
 
+# The order that the layers of the city are drawn in, from the bottom up
+LAYERS = {'street': 0, 'intersection': 1, 'place': 2, 'bus_stop': 3}
+
+
+def draw_city(city: City, screen: pygame.Surface) -> None:
+    """Draws the given city within the pygame window
+    """
+    # Loop through the streets to draw them
+    for street in city.get_streets():
+        draw_street(street, screen)
+
+    # Loop through the places to draw them, with the intersections underneath
+    places = [(city.get_place_kind(pos), pos) for pos in city.get_all_places()]
+    for kind, pos in sorted(places, key=lambda place: LAYERS[place[0]]):
+        draw_place(pos, kind, screen)
+
+    # Loop through the bus stops to draw them
+    for pos in city.get_all_bus_stops():
+        draw_place(pos, 'bus_stop', screen)
+
+
+def draw_place(pos: tuple[float, float], kind: str, screen: pygame.Surface) -> None:
+    """Draws the vertex of the given kind ('place', 'intersection' or 'bus_stop') centred at
+    pos within the pygame window
+    """
+    x, y = pos
+    if kind == 'intersection':
+        pygame.draw.circle(screen, STREET, (x, y), City.STREET_WIDTH)
+    else:
+        width = _Place.WIDTH
+        rect = pygame.Rect(x - width // 2, y - width // 2, width, width)
+        pygame.draw.rect(screen, BUS_STOP if kind == 'bus_stop' else PLACE, rect)
+
+
+def draw_street(street: tuple[tuple, tuple], screen: pygame.Surface) -> None:
+    """
+    Draw a street (a line) between two positions on a screen.
+    """
+    _draw_thick_line(screen, STREET, street[0], street[1], City.STREET_WIDTH)
+
+
+def draw_highlighted_street(street: tuple[tuple, tuple], screen: pygame.Surface,
+                            colour: tuple) -> None:
+    """
+    Draw a highlighted street (a line) between two positions on a screen.
+    """
+    _draw_thick_line(screen, colour, street[0], street[1], City.STREET_WIDTH)
+
+
+def _draw_thick_line(screen: pygame.Surface, colour: tuple, start: tuple, end: tuple,
+                     width: int) -> None:
+    """
+    Draw a line of the given width between two positions on a screen, as a filled rectangle.
+
+    pygame.draw.line moves the ends of a thick line to the edge of the screen's clipping
+    area before drawing it, so it draws different pixels depending on the clipping area.
+    A polygon is filled the same way whatever the clipping area is, which CityRenderer
+    relies on to redraw only part of the city.
+    """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = math.sqrt(dx * dx + dy * dy)
+    if length == 0:
+        return
+
+    nx, ny = -dy / length * width / 2, dx / length * width / 2
+    pygame.draw.polygon(screen, colour, [(start[0] + nx, start[1] + ny),
+                                         (end[0] + nx, end[1] + ny),
+                                         (end[0] - nx, end[1] - ny),
+                                         (start[0] - nx, start[1] - ny)])
+
+
+class CityRenderer:
+    """Draws a city onto the pygame window without redrawing all of it every frame.
+
+    The streets, places and bus stops are drawn once onto an offscreen layer. When the city
+    changes, sync compares it against what is on the layer, and only redraws the parts of
+    the layer around the elements that were added or removed. Highlighted streets (paths and
+    bus routes) are overlays, which are drawn on the screen over the layer. render only
+    copies the parts of the layer and overlays that changed to the screen, and returns them
+    so that only those parts of the display have to be updated.
+
+    Instance Attributes:
+        - city: The city being drawn
+        - layer: The offscreen surface that the city is drawn on
+
+    Private Instance Attributes:
+        - _drawn: A grid of the (kind, key) of every element on the layer, where the key is
+                  the position of a place or bus stop, or the pair of positions of a street,
+                  stored with the box that was drawn for it
+        - _on_layer: A dictionary mapping 'street', 'place' and 'bus_stop' to the keys of the
+                     elements of that kind on the layer (intersections count as places)
+        - _overlays: The highlighted streets drawn over the layer, as (street, colour) pairs
+        - _dirty: The parts of the screen that have to be drawn again by render
+        - _max_dirty: The number of changed parts above which the whole screen is redrawn
+                      instead
+    """
+    city: City
+    layer: pygame.Surface
+    _drawn: GridIndex
+    _on_layer: dict[str, set]
+    _overlays: list[tuple[tuple, tuple]]
+    _dirty: list[pygame.Rect]
+    _max_dirty: int
+
+    def __init__(self, city: City, size: tuple[int, int], max_dirty: int = 256) -> None:
+        self.city = city
+        self.layer = pygame.Surface(size)
+        self._drawn = GridIndex()
+        self._on_layer = dict()
+        self._overlays = []
+        self._dirty = []
+        self._max_dirty = max_dirty
+        self.redraw()
+
+    def redraw(self) -> None:
+        """Draw the whole city onto the layer again
+        """
+        self._on_layer = {'street': self.city.get_streets(),
+                          'place': self.city.get_all_places(),
+                          'bus_stop': self.city.get_all_bus_stops()}
+
+        self._drawn.clear()
+        for kind, keys in self._on_layer.items():
+            for key in keys:
+                element = (self.city.get_place_kind(key), key) if kind == 'place' else (kind, key)
+                self._drawn.insert(element, self._box(*element))
+
+        self.layer.fill(GRASS)
+        draw_city(self.city, self.layer)
+        self._dirty = [self.layer.get_rect()]
+
+    def sync(self) -> None:
+        """Redraw the parts of the layer where elements were added to or removed from the city
+        since the last sync
+        """
+        removed, added = [], []
+        for kind, current in [('street', self.city.get_streets()),
+                              ('place', self.city.get_all_places()),
+                              ('bus_stop', self.city.get_all_bus_stops())]:
+            drawn = self._on_layer[kind]
+            removed.extend(self._element(kind, key) for key in drawn - current)
+            added.extend(self._element(kind, key) for key in current - drawn)
+            self._on_layer[kind] = current
+
+        if len(removed) + len(added) > self._max_dirty:
+            self.redraw()
+            return
+
+        rects = [self._rect(self._drawn.get_box(element)) for element in removed]
+        for element in removed:
+            self._drawn.remove(element)
+        for kind, key in added:
+            box = self._box(kind, key)
+            self._drawn.insert((kind, key), box)
+            rects.append(self._rect(box))
+
+        for rect in rects:
+            self._redraw_region(rect)
+        self._dirty.extend(rects)
+
+    def invalidate(self) -> None:
+        """Mark the whole screen as changed, so that the next render draws all of it again
+        (for when the window has been uncovered or restored), without redrawing the layer
+        """
+        self._dirty = [self.layer.get_rect()]
+
+    def set_overlays(self, overlays: list[tuple[tuple, tuple]]) -> None:
+        """Replace the highlighted streets drawn over the city with the given (street, colour)
+        pairs
+        """
+        for street, _ in self._overlays + overlays:
+            self._dirty.append(self._rect(self._box('street', street)))
+        self._overlays = overlays
+
+    def render(self, screen: pygame.Surface) -> list[pygame.Rect]:
+        """Draw every part of the screen that changed since the last render, and return those
+        parts (for pygame.display.update)
+        """
+        dirty = self._dirty
+        if len(dirty) > self._max_dirty:
+            dirty = [dirty[0].unionall(dirty[1:])]
+
+        for rect in dirty:
+            screen.blit(self.layer, rect, rect)
+            screen.set_clip(rect)
+            for street, colour in self._overlays:
+                if rect.colliderect(self._rect(self._box('street', street))):
+                    draw_highlighted_street(street, screen, colour)
+            screen.set_clip(None)
+
+        self._dirty = []
+        return dirty
+
+    def _redraw_region(self, rect: pygame.Rect) -> None:
+        """Fill the given part of the layer with grass and draw every element overlapping it
+        again, from the bottom layer up
+        """
+        box = (rect.left, rect.top, rect.right, rect.bottom)
+        elements = sorted(self._drawn.query_box(box), key=lambda element: LAYERS[element[0]])
+
+        self.layer.set_clip(rect)
+        self.layer.fill(GRASS)
+        for kind, key in elements:
+            if kind == 'street':
+                draw_street(key, self.layer)
+            else:
+                draw_place(key, kind, self.layer)
+        self.layer.set_clip(None)
+
+    def _element(self, kind: str, key: tuple) -> tuple[str, tuple]:
+        """Return the (kind, key) of the element with the given key, telling apart places and
+        intersections
+
+        Preconditions:
+            - kind in {'street', 'place', 'bus_stop'}
+        """
+        if kind == 'place':
+            if ('intersection', key) in self._drawn:
+                return ('intersection', key)
+            elif ('place', key) not in self._drawn:
+                return (self.city.get_place_kind(key), key)
+        return (kind, key)
 
-class Drawable:
-    """An abstract class representing the drawable items in the pygame window"""
+    @staticmethod
+    def _box(kind: str, key: tuple) -> tuple[float, float, float, float]:
+        """Return a box (min x, min y, max x, max y) containing everything drawn for the
+        element of the given kind and key
+        """
+        if kind == 'street':
+            (x1, y1), (x2, y2) = key
+            pad = City.STREET_WIDTH
+            return (min(x1, x2) - pad, min(y1, y2) - pad, max(x1, x2) + pad, max(y1, y2) + pad)
+        else:
+            x, y = key
+            pad = max(City.STREET_WIDTH, _Place.WIDTH // 2) + 1
+            return (x - pad, y - pad, x + pad, y + pad)
 
-    def draw(self, screen: pygame.Surface) -> None:
-        """Returns the drawn form of the drawable item within the pygame window"""
-        raise NotImplementedError
+    @staticmethod
+    def _rect(box: tuple[float, float, float, float]) -> pygame.Rect:
+        """Return the given box as a pygame Rect
+        """
+        return pygame.Rect(box[0], box[1], box[2] - box[0] + 1, box[3] - box[1] + 1)